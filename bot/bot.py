@@ -11,6 +11,7 @@ from discord import app_commands, Interaction, Embed, Guild, TextChannel
 from .helpers.db import db
 from .helpers.api import api
 from .helpers.configs import Config
+from .helpers.dispatcher import ActionDispatcher
 from .helpers.errors import CustomError, APIError
 
 
@@ -24,6 +25,20 @@ class G5Bot(commands.AutoShardedBot):
         self.description = ""
         self.logger = logging.getLogger('Bot')
         self.tree.on_error = self.on_app_command_error
+        self.dispatcher = ActionDispatcher(
+            route_limits={
+                'move_member': Config.voice_move_concurrency,
+                'create_channel': 2,
+                'edit_channel': 2,
+                'delete_channel': 2,
+            },
+            default_route_limit=5,
+            guild_limit=Config.dispatch_guild_concurrency
+        )
+
+    async def setup_hook(self) -> None:
+        """"""
+        self.dispatcher.start()
 
     async def notify(self, *users, channel: TextChannel):
         """"""
@@ -115,6 +130,7 @@ class G5Bot(commands.AutoShardedBot):
     async def close(self):
         """"""
         await super().close()
+        await self.dispatcher.close()
         await db.close()
         await api.close()
 
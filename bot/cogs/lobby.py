@@ -1,16 +1,20 @@
 # lobby.py
 
 from asyncpg.exceptions import UniqueViolationError
-from typing import List, Optional
+from typing import Dict, List, Optional, Set
 from collections import defaultdict
 import asyncio
 
 from discord.ext import commands
-from discord import app_commands, Interaction, Embed, Member, VoiceState, HTTPException, SelectOption
+from discord import app_commands, Interaction, Embed, Guild, Member, Message, VoiceState, HTTPException, NotFound, SelectOption
 
 from bot.helpers.db import db
 from bot.helpers.api import api
-from bot.helpers.models import LobbyModel
+from bot.helpers.models import GuildModel, LobbyModel
+from bot.helpers.lobby_queue import LobbyQueue
+from bot.helpers.debounce import Debouncer
+from bot.helpers.dispatcher import PRIORITY_MOVE, PRIORITY_EMBED
+from bot.helpers.workers import Job, WorkerPool
 from bot.helpers.errors import CustomError, JoinLobbyError
 from bot.views import ReadyView, DropDownView
 from bot.bot import G5Bot
@@ -60,6 +64,17 @@ GAME_MODE_CHOICES = [
     app_commands.Choice(name="Wingman", value="wingman")
 ]
 
+# Seconds to wait for more queue changes before editing the queue message.
+QUEUE_MSG_DELAY = 1.5
+
+JOIN_REFUSALS = {
+    'not_linked': "User not linked",
+    'in_match': "User in match",
+    'in_lobby': "User in lobby",
+    'full': "Lobby is full",
+    'in_setup': "User in match setup",
+}
+
 
 class LobbyCog(commands.Cog, name="Lobby"):
     """"""
@@ -67,7 +82,55 @@ class LobbyCog(commands.Cog, name="Lobby"):
     def __init__(self, bot: G5Bot):
         self.bot = bot
         self.locks = defaultdict(lambda: asyncio.Lock())
-        self.in_progress = defaultdict(lambda: False)
+        # Ready checks and match setups run here, off the lobby locks.
+        self.setup_workers = WorkerPool('Match setup', Config.match_setup_workers)
+        self.setup_users: Set[int] = set()
+        # In-memory lobby index, so voice traffic outside of lobbies never hits the database.
+        self.lobbies: Dict[int, LobbyModel] = {}
+        self.voice_lobbies: Dict[int, LobbyModel] = {}
+        self.queues: Dict[int, LobbyQueue] = {}
+        self.queue_messages: Dict[int, Message] = {}
+        self.queue_msg_updates = Debouncer(QUEUE_MSG_DELAY, self._edit_queue_msg)
+
+    async def cog_unload(self):
+        """"""
+        await self.setup_workers.close()
+
+    def cache_lobby(self, lobby_model: LobbyModel):
+        """ Add or refresh a lobby in the in-memory index. """
+        self.uncache_lobby(lobby_model.id)
+        self.lobbies[lobby_model.id] = lobby_model
+        if lobby_model.voice_channel:
+            self.voice_lobbies[lobby_model.voice_channel.id] = lobby_model
+
+    def uncache_lobby(self, lobby_id: int):
+        """ Remove a lobby from the in-memory index. """
+        lobby_model = self.lobbies.pop(lobby_id, None)
+        if lobby_model and lobby_model.voice_channel:
+            self.voice_lobbies.pop(lobby_model.voice_channel.id, None)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """ Build the in-memory lobby index from the database. """
+        # Let the current queues finish writing so the rebuild reads their last state.
+        await asyncio.gather(*[queue.flush() for queue in self.queues.values()])
+        lobbies = await db.get_lobbies(self.bot)
+        queued_users = await db.get_all_lobby_users()
+        self.lobbies.clear()
+        self.voice_lobbies.clear()
+        self.queues.clear()
+        for lobby_model in lobbies:
+            self.cache_lobby(lobby_model)
+            self.queues[lobby_model.id] = LobbyQueue(
+                lobby_model.id, lobby_model.guild, queued_users.get(lobby_model.id))
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: Guild):
+        """"""
+        for lobby_model in list(self.lobbies.values()):
+            if lobby_model.guild.id == guild.id:
+                self.uncache_lobby(lobby_model.id)
+                self.queues.pop(lobby_model.id, None)
 
     @app_commands.command(
         name='create-lobby',
@@ -156,7 +219,9 @@ class LobbyCog(commands.Cog, name="Lobby"):
         await db.insert_lobby_maps(lobby_id, all_maps[:7])
 
         lobby_model = await db.get_lobby_by_id(lobby_id, self.bot)
-        await self.update_queue_msg(lobby_model)
+        self.cache_lobby(lobby_model)
+        self.queues[lobby_id] = LobbyQueue(lobby_id, guild)
+        self.update_queue_msg(lobby_model)
 
         embed = Embed(
             description=f"Lobby #{lobby_id} created successfully.")
@@ -189,6 +254,11 @@ class LobbyCog(commands.Cog, name="Lobby"):
             self.bot.log_exception(f"Failed to remove lobby #{lobby_id}:", e)
             raise CustomError("Something went wrong! Please try again later.")
 
+        self.uncache_lobby(lobby_id)
+        self.queues.pop(lobby_id, None)
+        await self.queue_msg_updates.cancel(lobby_id)
+        self.queue_messages.pop(lobby_id, None)
+
         for channel in [
             lobby_model.voice_channel,
             lobby_model.text_channel,
@@ -222,14 +292,17 @@ class LobbyCog(commands.Cog, name="Lobby"):
             raise CustomError("This lobby was not created in this server.")
 
         async with self.locks[lobby_model.id]:
-            for user in lobby_model.voice_channel.members:
-                try:
-                    await user.move_to(guild_model.prematch_channel)
-                except Exception as e:
-                    pass
-
-            await db.clear_lobby_users(lobby_model.id)
-            await self.update_queue_msg(lobby_model, title="Lobby has been emptied")
+            await asyncio.gather(*[
+                self.bot.dispatcher.submit(
+                    'move_member', guild.id,
+                    lambda user=user: user.move_to(guild_model.prematch_channel),
+                    PRIORITY_MOVE
+                )
+                for user in lobby_model.voice_channel.members
+            ], return_exceptions=True)
+
+            self.queues[lobby_model.id].clear()
+            self.update_queue_msg(lobby_model, title="Lobby has been emptied")
 
         embed = Embed(description=f"Lobby #{lobby_model.id} has been emptied.")
         await interaction.followup.send(embed=embed, ephemeral=True)
@@ -326,131 +399,207 @@ class LobbyCog(commands.Cog, name="Lobby"):
             return
 
         if before.channel is not None:
-            lobby_model = await db.get_lobby_by_voice_channel(before.channel)
+            lobby_model = self.voice_lobbies.get(before.channel.id)
             if lobby_model:
-                if not self.in_progress[lobby_model.id]:
-                    async with self.locks[lobby_model.id]:
-                        try:
-                            await self._leave(user, lobby_model)
-                        except Exception as e:
-                            self.bot.log_exception(
-                                "Uncaght exception when handling 'cogs.lobby._leave()' method:", e)
+                async with self.locks[lobby_model.id]:
+                    try:
+                        await self._leave(user, lobby_model)
+                    except Exception as e:
+                        self.bot.log_exception(
+                            "Uncaght exception when handling 'cogs.lobby._leave()' method:", e)
 
         if after.channel is not None:
-            lobby_model = await db.get_lobby_by_voice_channel(after.channel)
+            lobby_model = self.voice_lobbies.get(after.channel.id)
             if lobby_model and lobby_model.text_channel:
-                if not self.in_progress[lobby_model.id]:
-                    async with self.locks[lobby_model.id]:
-                        try:
-                            await self._join(user, lobby_model)
-                        except Exception as e:
-                            self.bot.log_exception(
-                                "Uncaught exception when handling 'cogs.lobby._join()' method:", e)
+                async with self.locks[lobby_model.id]:
+                    try:
+                        await self._join(user, lobby_model)
+                    except Exception as e:
+                        self.bot.log_exception(
+                            "Uncaught exception when handling 'cogs.lobby._join()' method:", e)
 
     async def _leave(self, user: Member, lobby_model: LobbyModel):
         """"""
-        removed = await db.delete_lobby_users(lobby_model.id, [user])
+        removed = self.queues[lobby_model.id].remove([user])
         if removed:
             title = f"User {user.display_name} removed from the lobby"
-            await self.update_queue_msg(lobby_model, title)
+            self.update_queue_msg(lobby_model, title)
 
     async def _join(self, user: Member, lobby_model: LobbyModel):
         """"""
-        queued_users = await db.get_lobby_users(lobby_model.id, lobby_model.guild)
+        queue = self.queues[lobby_model.id]
         try:
-            await self.add_user_to_lobby(user, lobby_model, queued_users)
+            await self.add_user_to_lobby(user, lobby_model, queue)
         except JoinLobbyError as e:
             title = e.message
         else:
             title = f"User **{user.display_name}** added to the queue."
-            queued_users.append(user)
+            if await self._start_setup_if_full(lobby_model, queue):
+                return
 
-            if len(queued_users) == lobby_model.capacity:
-                self.in_progress[lobby_model.id] = True
-                title = None
-                guild_model = await db.get_guild_by_id(lobby_model.guild.id, self.bot)
-                lobby_model = await db.get_lobby_by_id(lobby_model.id, self.bot)
+        self.update_queue_msg(lobby_model, title)
 
-                try:
-                    queue_msg = await lobby_model.text_channel.fetch_message(lobby_model.message_id)
-                    await queue_msg.delete()
-                except:
-                    pass
+    async def _start_setup_if_full(self, lobby_model: LobbyModel, queue: LobbyQueue) -> bool:
+        """ Hand the first `capacity` queued users to a setup worker once the queue is full.
 
-                unreadied_users = []
-                if not lobby_model.auto_ready:
-                    ready_view = ReadyView(queued_users, lobby_model.text_channel)
-                    await ready_view.start()
-                    await ready_view.wait()
-                    unreadied_users = set(queued_users) - ready_view.ready_users
-
-                if unreadied_users:
-                    awaitables = [u.move_to(guild_model.prematch_channel) for u in unreadied_users]
-                    awaitables.append(db.delete_lobby_users(lobby_model.id, unreadied_users))
-                    await asyncio.gather(*awaitables, return_exceptions=True)
-                else:
-                    embed = Embed(description='Starting match setup...')
-                    setup_match_msg = await lobby_model.text_channel.send(embed=embed)
-
-                    map_pool = await db.get_lobby_maps(lobby_model.id)
-                    match_cog = self.bot.get_cog('Match')
-                    match_started = await match_cog.start_match(
-                        lobby_model.guild,
-                        setup_match_msg,
-                        map_pool,
-                        queue_users=queued_users,
-                        game_mode=lobby_model.game_mode,
-                        team_method=lobby_model.team_method,
-                        captain_method=lobby_model.captain_method,
-                        map_method=lobby_model.map_method,
-                        series=lobby_model.series,
-                        region=lobby_model.region,
-                        season_id=lobby_model.season_id
-                    )
-                    if not match_started:
-                        awaitables = [u.move_to(guild_model.prematch_channel) for u in queued_users]
-                        await asyncio.gather(*awaitables, return_exceptions=True)
-
-                    await db.clear_lobby_users(lobby_model.id)
-                self.in_progress[lobby_model.id] = False
-
-        await self.update_queue_msg(lobby_model, title)
-
-    async def add_user_to_lobby(self, user: Member, lobby_model: LobbyModel, queued_users: List[Member]):
-        """"""
-        user_model = await db.get_user_by_discord_id(user.id, self.bot)
-        match_data = await db.get_user_match(user.id, lobby_model.guild)
-
-        if not user_model or not user_model.steam:
-            raise JoinLobbyError(user, "User not linked")
-        if match_data:
-            raise JoinLobbyError(user, "User in match")
-        if user in queued_users:
-            raise JoinLobbyError(user, "User in lobby")
-        if len(queued_users) >= lobby_model.capacity:
-            raise JoinLobbyError(user, "Lobby is full")
-        try:
-            await db.insert_lobby_user(lobby_model.id, user)
-        except UniqueViolationError:
-            raise JoinLobbyError(user, "Please try again")
+        Must be called with the lobby lock held. Returns whether a setup was started.
+        """
+        lobby_model = self.lobbies[lobby_model.id]
+        queued_users = queue.users
+        if len(queued_users) < lobby_model.capacity:
+            return False
 
-    async def update_queue_msg(self, lobby_model: LobbyModel, title: str = None):
+        if len(queued_users) == lobby_model.capacity:
+            queue.clear()
+        else:
+            # Requeued users made it overflow, the last joiners wait for the next setup.
+            queued_users = queued_users[:lobby_model.capacity]
+            queue.remove(queued_users)
+        self.setup_users.update(u.id for u in queued_users)
+
+        await self.queue_msg_updates.cancel(lobby_model.id)
+        queue_msg = self.queue_messages.pop(lobby_model.id, None)
+        if queue_msg is None and lobby_model.message_id:
+            queue_msg = lobby_model.text_channel.get_partial_message(lobby_model.message_id)
+        if queue_msg is not None:
+            try:
+                await queue_msg.delete()
+            except HTTPException:
+                pass
+
+        self.setup_workers.submit(
+            f"Lobby #{lobby_model.id}",
+            lambda job: self._setup_match(job, lobby_model, queued_users))
+        return True
+
+    async def _setup_match(self, job: Job, lobby_model: LobbyModel, queued_users: List[Member]):
+        """ Run the ready check and match setup of a filled lobby.
+
+        The lobby's queue has already been released, so this runs in the
+        setup worker pool without holding the lobby lock.
+        """
+        requeued = False
+        try:
+            guild_model = await db.get_guild_by_id(lobby_model.guild.id, self.bot)
+
+            unreadied_users = []
+            if not lobby_model.auto_ready:
+                job.stage = 'ready_check'
+                ready_view = ReadyView(queued_users, lobby_model.text_channel)
+                await ready_view.start()
+                await ready_view.wait()
+                unreadied_users = set(queued_users) - ready_view.ready_users
+
+            if unreadied_users:
+                job.stage = 'requeue'
+                await self.move_to_prematch(unreadied_users, guild_model)
+                # The requeued users may go straight into the next setup.
+                self.setup_users.difference_update(u.id for u in queued_users)
+                requeued = True
+                await self._requeue(lobby_model, [u for u in queued_users if u not in unreadied_users])
+            else:
+                job.stage = 'match_setup'
+                embed = Embed(description='Starting match setup...')
+                setup_match_msg = await lobby_model.text_channel.send(embed=embed)
+
+                map_pool = await db.get_lobby_maps(lobby_model.id)
+                match_cog = self.bot.get_cog('Match')
+                match_started = await match_cog.start_match(
+                    lobby_model.guild,
+                    setup_match_msg,
+                    map_pool,
+                    queue_users=queued_users,
+                    game_mode=lobby_model.game_mode,
+                    team_method=lobby_model.team_method,
+                    captain_method=lobby_model.captain_method,
+                    map_method=lobby_model.map_method,
+                    series=lobby_model.series,
+                    region=lobby_model.region,
+                    season_id=lobby_model.season_id
+                )
+                if not match_started:
+                    await self.move_to_prematch(queued_users, guild_model)
+        finally:
+            if not requeued:
+                self.setup_users.difference_update(u.id for u in queued_users)
+            self.update_queue_msg(lobby_model)
+
+    async def move_to_prematch(self, users: List[Member], guild_model: GuildModel):
+        """ Move users to the pre-match channel through the action dispatcher. """
+        await asyncio.gather(*[
+            self.bot.dispatcher.submit(
+                'move_member', guild_model.guild.id,
+                lambda user=user: user.move_to(guild_model.prematch_channel),
+                PRIORITY_MOVE
+            )
+            for user in users
+        ], return_exceptions=True)
+
+    async def _requeue(self, lobby_model: LobbyModel, users: List[Member]):
+        """ Put readied users back at the front of the queue if they are still in the lobby channel.
+
+        Users who joined meanwhile may have filled the lobby again, the next setup is then started.
+        """
+        async with self.locks[lobby_model.id]:
+            queue = self.queues.get(lobby_model.id)
+            if queue is None:
+                return
+            queue.prepend([
+                user for user in users
+                if user.voice and user.voice.channel == lobby_model.voice_channel
+            ])
+            await self._start_setup_if_full(lobby_model, queue)
+
+    async def add_user_to_lobby(self, user: Member, lobby_model: LobbyModel, queue: LobbyQueue):
         """"""
-        if not lobby_model.text_channel or not lobby_model.voice_channel:
+        if user.id in self.setup_users:
+            raise JoinLobbyError(user, JOIN_REFUSALS['in_setup'])
+        if user in queue:
+            raise JoinLobbyError(user, JOIN_REFUSALS['in_lobby'])
+        if len(queue) >= lobby_model.capacity:
+            raise JoinLobbyError(user, JOIN_REFUSALS['full'])
+
+        status = await queue.admit(user)
+        if status != 'ok':
+            raise JoinLobbyError(user, JOIN_REFUSALS.get(status, "Please try again"))
+
+    def update_queue_msg(self, lobby_model: LobbyModel, title: str = None):
+        """ Schedule an edit of the lobby's queue message.
+
+        Bursts of joins and leaves are merged into a single edit that renders
+        the queue as it is when the edit runs, with the latest title.
+        """
+        self.queue_msg_updates.schedule(lobby_model.id, title)
+
+    async def _edit_queue_msg(self, lobby_id: int, title: Optional[str]):
+        """"""
+        lobby_model = self.lobbies.get(lobby_id)
+        if not lobby_model or not lobby_model.text_channel or not lobby_model.voice_channel:
             return
 
-        lobby_model = await db.get_lobby_by_id(lobby_model.id, self.bot)
-        queued_users = await db.get_lobby_users(lobby_model.id, lobby_model.guild)
-
-        try:
-            queue_message = await lobby_model.text_channel.fetch_message(lobby_model.message_id)
-        except:
-            queue_message = await lobby_model.text_channel.send(embed=Embed(description="New Queue Message"))
-            await db.update_lobby_data(lobby_model.id, {'last_message': queue_message.id})
-
-        embed = self._embed_queue(
-            title, lobby_model, queued_users)
-        await queue_message.edit(embed=embed, view=None)
+        queued_users = self.queues[lobby_id].users
+        embed = self._embed_queue(title, lobby_model, queued_users)
+
+        queue_message = self.queue_messages.get(lobby_id)
+        if queue_message is None and lobby_model.message_id:
+            queue_message = lobby_model.text_channel.get_partial_message(lobby_model.message_id)
+
+        if queue_message is not None:
+            try:
+                self.queue_messages[lobby_id] = await self.bot.dispatcher.submit(
+                    'edit_message', lobby_model.guild.id,
+                    lambda: queue_message.edit(embed=embed, view=None), PRIORITY_EMBED,
+                    key=('edit_message', queue_message.id)
+                )
+                return
+            except NotFound:
+                pass
+
+        queue_message = await lobby_model.text_channel.send(embed=embed)
+        self.queue_messages[lobby_id] = queue_message
+        await db.update_lobby_data(lobby_id, {'last_message': queue_message.id})
+        lobby_model.message_id = queue_message.id
+        self.cache_lobby(lobby_model)
 
     def _embed_queue(self, title: str, lobby_model: LobbyModel, queued_users: List[Member]):
         """"""
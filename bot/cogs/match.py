@@ -1,16 +1,25 @@
 # match.py
 
 from discord.ext import commands, tasks
-from discord.errors import HTTPException
-from discord import Embed, app_commands, Member, Message, Interaction, Guild, SelectOption, Role, PermissionOverwrite
-from typing import Literal, List, Optional
+from discord.errors import HTTPException, NotFound
+from discord import Embed, app_commands, Member, Message, PartialMessage, Interaction, Guild, SelectOption, Role, PermissionOverwrite, CategoryChannel, VoiceChannel
+from typing import Dict, Literal, List, Optional
 
+from collections import deque
 from random import sample, shuffle
 from datetime import datetime
 import asyncio
+import hashlib
+import json
 
 from bot.helpers.api import api, Match, MapStat, Server, Season
 from bot.helpers.db import db
+from bot.helpers.balance import balance_teams
+from bot.helpers.channel_pool import ChannelPool
+from bot.helpers.debounce import Debouncer, KeyedLock
+from bot.helpers.events import EventReceiver
+from bot.helpers.scheduler import PollScheduler
+from bot.helpers.dispatcher import PRIORITY_MATCH_MOVE, PRIORITY_CHANNEL, PRIORITY_MOVE, PRIORITY_EMBED
 from bot.helpers.models import GuildModel, TeamModel, MatchModel
 from bot.bot import G5Bot
 from bot.helpers.errors import CustomError, APIError
@@ -19,11 +28,60 @@ from bot.views import VetoView, PickTeamsView, DropDownView, ConfirmView, ReadyV
 from .lobby import SERIES_CHOICES, CAPACITY_CHOICES, GAME_MODE_CHOICES
 
 
+# Seconds between two polls of a live match, per match state.
+MATCH_POLL_INTERVALS = {
+    'warmup': 30,
+    'live': 10,
+    'between_maps': 20,
+    'retry': 30,  # API unavailable or failing
+}
+
+
 class MatchCog(commands.Cog, name="Match"):
     """"""
 
     def __init__(self, bot: G5Bot):
         self.bot = bot
+        self.match_locks = KeyedLock()
+        self.finalized_ids = deque(maxlen=256)
+        self.match_events = Debouncer(1.0, self._handle_match_event)
+        self.event_receiver = EventReceiver(self.on_match_event) if Config.events_enabled else None
+        self.live_matches: Dict[int, MatchModel] = {}
+        self.guild_models: Dict[int, GuildModel] = {}
+        self.match_messages: Dict[int, Optional[PartialMessage]] = {}
+        self.embed_digests: Dict[int, str] = {}
+        self.channel_pool = ChannelPool(Config.channel_pool_size, bot.dispatcher)
+        self.match_poller = PollScheduler(
+            'Live matches',
+            self.poll_match,
+            Config.match_poll_concurrency,
+            retry_delay=MATCH_POLL_INTERVALS['retry']
+        )
+
+    async def cog_load(self):
+        """"""
+        self.match_poller.start()
+        if self.event_receiver and not await self.event_receiver.start():
+            # Matches are then updated by polling alone.
+            self.event_receiver = None
+
+    async def cog_unload(self):
+        """"""
+        await self.match_poller.close()
+        await self.channel_pool.close()
+        if self.event_receiver:
+            await self.event_receiver.close()
+
+    async def on_match_event(self, match_id: int, event: str):
+        """ Called by the event receiver, bursts of events of a match are coalesced. """
+        self.match_events.schedule(match_id, event)
+
+    async def _handle_match_event(self, match_id: int, event: str):
+        """"""
+        api.invalidate_match(match_id)
+        match_model = await db.get_match_by_id(match_id, self.bot)
+        if match_model:
+            await self.update_match_stats(match_model)
 
     async def select_team_participants(self, team_model: TeamModel, capacity: int, interaction: Interaction) -> List[Member]:
         """"""
@@ -485,27 +543,14 @@ class MatchCog(commands.Cog, name="Match"):
         except Exception as e:
             return self.randomize_teams(users)
 
-        stats_dict = dict(zip(leaderboard, users))
-        players_stats = list(stats_dict.keys())
-        players_stats.sort(key=lambda x: x.rating)
-
-        # Balance teams
-        team_size = len(players_stats) // 2
-        team1_stats = [players_stats.pop()]
-        team2_stats = [players_stats.pop()]
-
-        while players_stats:
-            if len(team1_stats) >= team_size:
-                team2_stats.append(players_stats.pop())
-            elif len(team2_stats) >= team_size:
-                team1_stats.append(players_stats.pop())
-            elif sum(p.rating for p in team1_stats) < sum(p.rating for p in team2_stats):
-                team1_stats.append(players_stats.pop())
-            else:
-                team2_stats.append(players_stats.pop())
+        players = list(zip(leaderboard, users))
+        team1_idx, team2_idx = balance_teams([stat.rating for stat, _ in players])
 
-        team1_users = list(map(stats_dict.get, team1_stats))
-        team2_users = list(map(stats_dict.get, team2_stats))
+        # Best rated player of each team goes first, as they become the team captain.
+        team1_players = sorted((players[i] for i in team1_idx), key=lambda p: p[0].rating, reverse=True)
+        team2_players = sorted((players[i] for i in team2_idx), key=lambda p: p[0].rating, reverse=True)
+        team1_users = [user for _, user in team1_players]
+        team2_users = [user for _, user in team2_players]
         return team1_users, team2_users
 
     async def pick_teams(self, message: Message, users: List[Member], captain_method: str):
@@ -594,11 +639,22 @@ class MatchCog(commands.Cog, name="Match"):
         team2_model: TeamModel=None,
         season_id: int=None,
     ):
-        """"""
+        """ Set up a match as a pipeline of stages.
+
+        Steps that do not depend on each other run concurrently: spectators
+        are loaded and the PUG teams are created on the API while players
+        pick maps, and the team channels are created while the match info
+        is fetched. Progress is reported as each stage completes.
+        """
         is_pug = len(queue_users) > 0
         team1_id = None
         team2_id = None
-        await asyncio.sleep(3)
+        match_id = None
+        create_team_tasks = []
+        spectators_task = asyncio.create_task(db.get_spectators(guild))
+        server_task = None
+        channels_task = None
+        match_task = None
         try:
             if not is_pug: # official match
                 team1_captain = team1_model.captain
@@ -607,8 +663,10 @@ class MatchCog(commands.Cog, name="Match"):
                 team2_name = team2_model.name
                 team1_id = team1_model.id
                 team2_id = team2_model.id
-                team1_users = await db.get_team_users(team1_id, guild)
-                team2_users = await db.get_team_users(team2_id, guild)
+                team1_users, team2_users = await asyncio.gather(
+                    db.get_team_users(team1_id, guild),
+                    db.get_team_users(team2_id, guild)
+                )
             else: # pug match
                 if team_method == 'captains' and len(queue_users) >= 4:
                     team1_users, team2_users = await self.pick_teams(message, queue_users, captain_method)
@@ -617,8 +675,10 @@ class MatchCog(commands.Cog, name="Match"):
                 else:  # team_method is random
                     team1_users, team2_users = self.randomize_teams(queue_users)
                 
-                team1_users_model = await db.get_users(team1_users)
-                team2_users_model = await db.get_users(team2_users)
+                team1_users_model, team2_users_model = await asyncio.gather(
+                    db.get_users(team1_users),
+                    db.get_users(team2_users)
+                )
                 team1_captain = team1_users[0]
                 team2_captain = team2_users[0]
                 team1_name = team1_captain.display_name
@@ -633,8 +693,11 @@ class MatchCog(commands.Cog, name="Match"):
                     'captain': user_model.user == team2_captain,
                     'coach': False,
                 } for user_model in team2_users_model}
-                team1_id = await api.create_team(team1_name, dict_team1_users)
-                team2_id = await api.create_team(team2_name, dict_team2_users)
+                # Teams are created on the API while the captains veto maps.
+                create_team_tasks = [
+                    asyncio.create_task(api.create_team(team1_name, dict_team1_users)),
+                    asyncio.create_task(api.create_team(team2_name, dict_team2_users))
+                ]
 
             if map_method == 'veto':
                 veto_view = VetoView(message, mpool, series, team1_captain, team2_captain, game_mode)
@@ -646,16 +709,18 @@ class MatchCog(commands.Cog, name="Match"):
 
             str_maps = ' '.join(m for m in maps_list)
 
+            # The server is searched for only once maps are set, so it is still free when the match is created.
+            server_task = asyncio.create_task(self.find_match_server(region))
             await message.edit(embed=Embed(description='Searching for available game servers...'), view=None)
-            await asyncio.sleep(2)
 
-            match_server = await self.find_match_server(region)
+            if create_team_tasks:
+                team1_id, team2_id = await asyncio.gather(*create_team_tasks)
+            match_server = await server_task
+            spectators = await spectators_task
 
             await message.edit(embed=Embed(description='Setting up match on game server...'), view=None)
-            await asyncio.sleep(2)
 
             dict_spectators = {}
-            spectators = await db.get_spectators(guild)
             for spec in spectators:
                 if spec.user not in team1_users and spec.user not in team2_users:
                     dict_spectators[spec.steam] = spec.user.display_name
@@ -673,14 +738,16 @@ class MatchCog(commands.Cog, name="Match"):
             )
 
             await message.edit(embed=Embed(description='Setting up teams channels...'), view=None)
-            category, team1_channel, team2_channel = await self.create_match_channels(
+            channels_task = asyncio.create_task(self.create_match_channels(
                 match_id,
                 team1_name,
                 team2_name,
                 team1_users,
                 team2_users,
                 guild
-            )
+            ))
+            match_task = asyncio.create_task(api.get_match(match_id))
+            (category, team1_channel, team2_channel), match_stats = await asyncio.gather(channels_task, match_task)
 
             await db.insert_match({
                 'id': match_id,
@@ -693,8 +760,8 @@ class MatchCog(commands.Cog, name="Match"):
                 'team1_channel': team1_channel.id,
                 'team2_channel': team2_channel.id
             })
-
-            match_stats = await api.get_match(match_id)
+            # The match row owns the channels from now on.
+            channels_task = None
             await db.insert_match_users(match_id, team1_users + team2_users)
             embed = self.embed_match_info(match_stats, match_server)
 
@@ -718,17 +785,34 @@ class MatchCog(commands.Cog, name="Match"):
 
             return True
 
+        pending_tasks = [task for task in [spectators_task, server_task] if task]
+        for task in pending_tasks:
+            task.cancel()
+        results = await asyncio.gather(*pending_tasks, return_exceptions=True)
+
+        # Give the leased server back if no match was created on it
+        if server_task and match_id is None and isinstance(results[-1], Server):
+            api.inventory.release(results[-1].id)
+
+        # Delete the channels created for a match that was never saved.
+        # Channel setup is waited for rather than cancelled, so no channel is left half made.
+        if match_task:
+            match_task.cancel()
+            await asyncio.gather(match_task, return_exceptions=True)
+        if channels_task:
+            channels = (await asyncio.gather(channels_task, return_exceptions=True))[0]
+            if isinstance(channels, tuple):
+                category, team1_channel, team2_channel = channels
+                await self.channel_pool.delete(team1_channel, team2_channel, category)
+
         # Delete the created teams from api if setup didn't complete
         if is_pug:
-            if team1_id:
-                try:
-                    await api.delete_team(team1_id)
-                except Exception as e:
-                    self.bot.logger.warning(str(e))
-
-            if team2_id:
+            results = await asyncio.gather(*create_team_tasks, return_exceptions=True)
+            for team_id in results:
+                if isinstance(team_id, BaseException):
+                    continue
                 try:
-                    await api.delete_team(team2_id)
+                    await api.delete_team(team_id)
                 except Exception as e:
                     self.bot.logger.warning(str(e))
 
@@ -740,23 +824,10 @@ class MatchCog(commands.Cog, name="Match"):
             pass
 
     async def find_match_server(self, region=None):
-        """"""
-        servers = await api.get_servers()
-
-        for server in servers:
-            if server.in_use:
-                continue
-
-            if region and server.flag != region:
-                continue
-
-            try:
-                is_available = await api.is_server_available(server.id)
-                if is_available:
-                    return server
-            except Exception as e:
-                self.bot.log_exception('API ERROR: ', e)
-                continue
+        """ Lease the best available server of the region from the API server inventory. """
+        server = await api.inventory.acquire(region)
+        if server:
+            return server
 
         raise ValueError("No game server available.")
 
@@ -769,84 +840,183 @@ class MatchCog(commands.Cog, name="Match"):
         team2_users: List[Member],
         guild: Guild
     ):
-        """"""
-        match_catg = await guild.create_category_channel(f"Match #{match_id}")
-        team1_channel, team2_channel = None, None
+        """ Lease the match channels from the guild's pool, or create them if it is empty. """
         team1_overwrites = {u: PermissionOverwrite(connect=True) for u in team1_users}
         team1_overwrites[guild.default_role] = PermissionOverwrite(connect=False)
         team2_overwrites = {u: PermissionOverwrite(connect=True) for u in team2_users}
         team2_overwrites[guild.default_role] = PermissionOverwrite(connect=False)
 
-        try:
-            team1_channel = await guild.create_voice_channel(
-                name=f"Team {team1_name}",
-                category=match_catg,
-                overwrites=team1_overwrites
+        leased = await self.channel_pool.lease(
+            guild, match_id, (team1_name, team2_name), (team1_overwrites, team2_overwrites))
+        if leased:
+            match_catg, team1_channel, team2_channel = leased
+        else:
+            dispatcher = self.bot.dispatcher
+            match_catg = await dispatcher.submit(
+                'create_channel', guild.id,
+                lambda: guild.create_category_channel(f"Match #{match_id}"),
+                PRIORITY_CHANNEL
             )
-        except HTTPException as e:
-            self.bot.logger.warning(e)
-            if e.code == 50035:
-                team1_channel = await guild.create_voice_channel(
-                    name=f"Team 1",
-                    category=match_catg,
-                    overwrites=team1_overwrites
+            team1_channel, team2_channel = await asyncio.gather(
+                dispatcher.submit(
+                    'create_channel', guild.id,
+                    lambda: self._create_team_channel(guild, match_catg, team1_name, "Team 1", team1_overwrites),
+                    PRIORITY_CHANNEL
+                ),
+                dispatcher.submit(
+                    'create_channel', guild.id,
+                    lambda: self._create_team_channel(guild, match_catg, team2_name, "Team 2", team2_overwrites),
+                    PRIORITY_CHANNEL
                 )
-        
+            )
+
+        moves = [(user, team1_channel) for user in team1_users] + [(user, team2_channel) for user in team2_users]
+        await asyncio.gather(*[
+            self.bot.dispatcher.submit(
+                'move_member', guild.id, lambda user=user, channel=channel: user.move_to(channel), PRIORITY_MATCH_MOVE)
+            for user, channel in moves
+        ], return_exceptions=True)
+
+        return match_catg, team1_channel, team2_channel
+
+    async def _create_team_channel(
+        self,
+        guild: Guild,
+        category: CategoryChannel,
+        team_name: str,
+        fallback_name: str,
+        overwrites: dict
+    ) -> Optional[VoiceChannel]:
+        """ Create a team voice channel, falling back to a generic name if Discord rejects the team name. """
         try:
-            team2_channel = await guild.create_voice_channel(
-                name=f"Team {team2_name}",
-                category=match_catg,
-                overwrites=team2_overwrites
+            return await guild.create_voice_channel(
+                name=f"Team {team_name}",
+                category=category,
+                overwrites=overwrites
             )
         except HTTPException as e:
             self.bot.logger.warning(e)
             if e.code == 50035:
-                team2_channel = await guild.create_voice_channel(
-                    name=f"Team 2",
-                    category=match_catg,
-                    overwrites=team2_overwrites
+                return await guild.create_voice_channel(
+                    name=fallback_name,
+                    category=category,
+                    overwrites=overwrites
                 )
 
-        awaitables = []
-        for user in team1_users:
-            awaitables.append(user.move_to(team1_channel))
-        for user in team2_users:
-            awaitables.append(user.move_to(team2_channel))
-        await asyncio.gather(*awaitables, return_exceptions=True)
-
-        return match_catg, team1_channel, team2_channel
-
     async def finalize_match(self, match_model: MatchModel, guild_model: GuildModel):
-        """"""
-        match_players = await db.get_match_users(match_model.id, match_model.guild)
-        move_aws = [user.move_to(guild_model.prematch_channel) for user in match_players]
-        delete_aws = [
-            match_model.team1_channel.delete(),
-            match_model.team2_channel.delete(),
-            match_model.category.delete(),
-            db.delete_match(match_model.id)
-        ]
-        await asyncio.gather(*move_aws, return_exceptions=True)
-        await asyncio.gather(*delete_aws, return_exceptions=True)
+        """ Tear a match down: move its players out, release or delete its channels, then its row.
+
+        The match is flagged as finished first and every step is safe to run
+        again, so a teardown interrupted by a restart is resumed by the next poll.
+        """
+        if not match_model.finished:
+            await db.set_match_finished(match_model.id)
+            match_model.finished = True
+
+        # Only members still in the team channels need a move, taken from the voice state cache.
+        team_channels = [c for c in [match_model.team1_channel, match_model.team2_channel] if c]
+        released = False
+        try:
+            await asyncio.gather(*[
+                self.bot.dispatcher.submit(
+                    'move_member', match_model.guild.id,
+                    lambda member=member: member.move_to(guild_model.prematch_channel),
+                    PRIORITY_MOVE
+                )
+                for channel in team_channels for member in channel.members
+            ], return_exceptions=True)
 
-    async def update_match_stats(self, match_model: MatchModel):
+            channels = [match_model.category, match_model.team1_channel, match_model.team2_channel]
+            if all(channels):
+                try:
+                    released = await self.channel_pool.release(*channels)
+                except Exception as e:
+                    self.bot.logger.warning(f"Failed to release channels of match #{match_model.id}: {e}")
+            if not released:
+                await self.channel_pool.delete(*team_channels, match_model.category)
+        except Exception as e:
+            # Leftover channels are not worth locking the players out of the lobbies.
+            self.bot.log_exception(f'Failed to clean up the channels of match #{match_model.id}: ', e)
+
+        await db.delete_match(match_model.id, pool_channels=released)
+        # The finished match changed the players' stats.
+        api.leaderboard.invalidate()
+        self.finalized_ids.append(match_model.id)
+        self.live_matches.pop(match_model.id, None)
+        self.match_messages.pop(match_model.id, None)
+        self.embed_digests.pop(match_model.id, None)
+
+    def get_match_message(self, match_model: MatchModel) -> Optional[PartialMessage]:
+        """ Handle of the match info message, built once without fetching it. None if it is gone. """
+        if match_model.id not in self.match_messages:
+            message = None
+            if match_model.text_channel and match_model.message_id:
+                message = match_model.text_channel.get_partial_message(match_model.message_id)
+            self.match_messages[match_model.id] = message
+        return self.match_messages[match_model.id]
+
+    async def edit_match_message(self, match_id: int, message: PartialMessage, embed: Embed):
+        """ Edit the match info message, unless it already shows the same embed. """
+        digest = hashlib.sha1(json.dumps(embed.to_dict(), sort_keys=True).encode()).hexdigest()
+        if self.embed_digests.get(match_id) == digest:
+            return
+        try:
+            await self.bot.dispatcher.submit(
+                'edit_message', message.guild.id, lambda: message.edit(embed=embed), PRIORITY_EMBED,
+                key=('edit_message', message.id)
+            )
+        except NotFound:
+            self.match_messages[match_id] = None
+        except Exception as e:
+            pass
+        else:
+            self.embed_digests[match_id] = digest
+
+    async def poll_match(self, match_id: int) -> Optional[float]:
+        """ Poll scheduler callback, returns the seconds until the next poll. """
+        match_model = self.live_matches.get(match_id)
+        if not match_model:
+            return
+        if not api.is_available("/api/matches") and not match_model.finished:
+            # G5API is failing, try again later.
+            return MATCH_POLL_INTERVALS['retry']
+
+        interval = await self.update_match_stats(match_model)
+        if interval is not None and self.event_receiver:
+            # Events drive the updates, polling only catches missed ones.
+            interval = max(interval, Config.events_poll_interval)
+        return interval
+
+    async def update_match_stats(self, match_model: MatchModel) -> Optional[float]:
+        """ Update a match from the API. Events and polling never update a match concurrently.
+
+        Returns the seconds until the match should be polled again, or None once it is finalized.
+        """
+        async with self.match_locks.hold(match_model.id):
+            if match_model.id in self.finalized_ids:
+                return
+            return await self._update_match_stats(match_model)
+
+    async def _update_match_stats(self, match_model: MatchModel) -> Optional[float]:
         """"""
         match_stats = None
         mapstats = []
         game_server = None
-        message = None
         season = None
-        guild_model = await db.get_guild_by_id(match_model.guild.id, self.bot)
+        guild_model = self.guild_models.get(match_model.guild.id) \
+            or await db.get_guild_by_id(match_model.guild.id, self.bot)
+        message = self.get_match_message(match_model)
 
-        try:
-            message = await match_model.text_channel.fetch_message(match_model.message_id)
-        except Exception as e:
-            pass
+        if match_model.finished:
+            # The teardown was interrupted, resume it.
+            await self.finalize_match(match_model, guild_model)
+            return
 
         try:
             match_stats = await api.get_match(match_model.id)
         except Exception as e:
-            pass
+            # Keep the match around until the API answers again.
+            return MATCH_POLL_INTERVALS['retry']
 
         if not match_stats:
             await self.finalize_match(match_model, guild_model)
@@ -870,13 +1040,14 @@ class MatchCog(commands.Cog, name="Match"):
 
         if message:
             embed = self.embed_match_info(match_stats, game_server, mapstats, season)
-            try:
-                await message.edit(embed=embed)
-            except Exception as e:
-                pass
+            await self.edit_match_message(match_model.id, message, embed)
 
         if not match_stats.end_time and not match_stats.cancelled and not match_stats.forfeit:
-            return
+            if not mapstats:
+                return MATCH_POLL_INTERVALS['warmup']
+            if not mapstats[-1].end_time:
+                return MATCH_POLL_INTERVALS['live']
+            return MATCH_POLL_INTERVALS['between_maps']
 
         try:
             await message.delete()
@@ -894,20 +1065,25 @@ class MatchCog(commands.Cog, name="Match"):
 
     @ tasks.loop(seconds=20.0)
     async def check_live_matches(self):
-        """"""
-        live_match = False
-        for guild in self.bot.guilds:
-            guild_matches = await db.get_guild_matches(guild)
-            if guild_matches:
-                live_match = True
-                aws = [self.update_match_stats(m) for m in guild_matches]
-                results = await asyncio.gather(*aws, return_exceptions=True)
-                for e in results:
-                    if isinstance(e, Exception):
-                        self.bot.log_exception(
-                            f'Uncaught exception when handling cogs.match.update_match_stats():', e)
-
-        if not live_match:
+        """ Discover live matches and hand them to the poll scheduler.
+
+        Guild models of the guilds with live matches are loaded once per tick
+        and shared by the polls until the next tick.
+        """
+        guild_matches = await db.get_live_matches(self.bot)
+        live_matches = {
+            match_model.id: match_model
+            for matches in guild_matches.values() for match_model in matches
+        }
+        self.guild_models = await db.get_guilds(list(guild_matches)) if guild_matches else {}
+
+        # Matches missing from the database stop being polled on their next poll.
+        self.live_matches = live_matches
+        for match_id in live_matches:
+            if match_id not in self.match_poller:
+                self.match_poller.schedule(match_id)
+
+        if not live_matches:
             self.check_live_matches.cancel()
 
 
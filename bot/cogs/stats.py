@@ -59,9 +59,7 @@ class StatsCog(commands.Cog, name="Stats"):
     async def leaderboard(self, interaction: Interaction):
         """"""
         await interaction.response.defer()
-        leaderboard = await api.get_leaderboard(interaction.guild.members)
-        leaderboard.sort(key=lambda u: (u.rating), reverse=True)
-        leaderboard = leaderboard[:10]
+        leaderboard = await api.get_top_players(interaction.guild, 10)
 
         # Generate leaderboard text
         data = [['Player'] + [player.name for player in leaderboard],
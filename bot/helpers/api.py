@@ -1,21 +1,51 @@
 # bot/helpers/api.py
 
 import asyncio
+import heapq
 import logging
 import json
 import aiohttp
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Literal, Optional, List, Dict
-from discord import Member
+from typing import Any, Awaitable, Callable, Hashable, Literal, Optional, List, Dict
+from discord import Guild, Member
 
 from bot.helpers.db import db
 from bot.helpers.configs import Config
 from bot.helpers.errors import APIError
+from bot.helpers.resilience import CircuitBreaker, backoff_delay
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# JSON codec of the API session, orjson is used when it is installed.
+if orjson:
+    def json_dumps(obj: Any) -> str:
+        """"""
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj: Any) -> str:
+        """"""
+        return json.dumps(obj, ensure_ascii=False)
+
+    json_loads = json.loads
 
 
 class Match:
     """"""
 
+    __slots__ = (
+        'id', 'user_id', 'server_id', 'team1_id', 'team2_id', 'winner', 'team1_score',
+        'team2_score', 'team1_string', 'team2_string', 'cancelled', 'forfeit', 'start_time',
+        'end_time', 'title', 'max_maps', 'season_id', 'is_pug'
+    )
+
     def __init__(self, match_data: dict) -> None:
         """"""
         self.id = match_data['id']
@@ -45,6 +75,11 @@ class Match:
 class MapStat:
     """"""
 
+    __slots__ = (
+        'id', 'match_id', 'winner', 'map_number', 'map_name', 'team1_score', 'team2_score',
+        'start_time', 'end_time'
+    )
+
     def __init__(self, data: dict) -> None:
         """"""
         self.id = data['id']
@@ -65,6 +100,11 @@ class MapStat:
 class PlayerStat:
     """"""
 
+    __slots__ = (
+        'steam', 'name', 'kills', 'deaths', 'assists', 'k1', 'k2', 'k3', 'k4', 'k5', 'v1', 'v2',
+        'v3', 'v4', 'v5', 'headshots', 'hsp', 'rating', 'wins', 'played'
+    )
+
     def __init__(self, data: dict) -> None:
         """"""
         self.steam = data["steamId"]
@@ -106,6 +146,11 @@ class PlayerStat:
 class Server:
     """"""
 
+    __slots__ = (
+        'id', 'ip_string', 'port', 'gotv_port', 'display_name', 'flag', 'public_server',
+        'in_use'
+    )
+
     def __init__(self, server_data: dict) -> None:
         """"""
         self.id = server_data['id']
@@ -125,6 +170,8 @@ class Server:
 class Team:
     """"""
 
+    __slots__ = ('id', 'user_id', 'name', 'tag', 'flag', 'logo', 'public_team', 'auth_name')
+
     def __init__(self, team_data: dict) -> None:
         """"""
         self.id = team_data['id']
@@ -144,6 +191,8 @@ class Team:
 class Season:
     """"""
 
+    __slots__ = ('id', 'name', 'start_date', 'end_date', 'matches')
+
     def __init__(self, season_data: dict, matches: List[Match]) -> None:
         """"""
         self.id = season_data['id']
@@ -158,6 +207,265 @@ class Season:
         return cls(season_data, matches)
 
 
+# Seconds a GET response stays cached, per endpoint.
+CACHE_TTLS = {
+    'match': 10,
+    'mapstats': 10,
+    'team': 60,
+    'server': 300,
+    'season': 3600,
+}
+
+_MISSING = object()
+
+# Leaderboard entry of a linked player who has no PUG stats yet.
+EMPTY_PLAYERSTAT = {
+    "kills": 0,
+    "deaths": 0,
+    "assists": 0,
+    "k1": 0,
+    "k2": 0,
+    "k3": 0,
+    "k4": 0,
+    "k5": 0,
+    "v1": 0,
+    "v2": 0,
+    "v3": 0,
+    "v4": 0,
+    "v5": 0,
+    "trp": 0,
+    "fba": 0,
+    "total_damage": 0,
+    "hsk": 0,
+    "hsp": 0.00,
+    "average_rating": 0.00,
+    "wins": 0,
+    "total_maps": 0
+}
+
+
+class TTLCache:
+    """ A size bounded LRU cache whose entries expire after their TTL. """
+
+    def __init__(self, maxsize: int) -> None:
+        """"""
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        """ Return a live entry and mark it as recently used. """
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= asyncio.get_event_loop().time():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        """ Store an entry, evicting the least recently used ones if full. """
+        self._data[key] = (asyncio.get_event_loop().time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """ Drop the given entries. """
+        for key in keys:
+            self._data.pop(key, None)
+
+    def invalidate_endpoint(self, endpoint: str) -> None:
+        """ Drop every entry of an endpoint. """
+        for key in [k for k in self._data if k[0] == endpoint]:
+            del self._data[key]
+
+
+class ServerStatus:
+    """ Health record of a game server kept by the server inventory. """
+
+    def __init__(self, server: Server) -> None:
+        """"""
+        self.server = server
+        self.available = None
+        self.failures = 0
+        self.latency = None
+        self.checked_at = None
+
+    @property
+    def score(self) -> float:
+        """ Lower is better: probe latency, penalized by recent failures. """
+        latency = self.latency if self.latency is not None else Config.server_probe_timeout
+        return latency * (1 + self.failures)
+
+    def record(self, available: bool, latency: Optional[float]) -> None:
+        """ Record the result of a status probe. """
+        self.available = available
+        self.latency = latency
+        self.checked_at = asyncio.get_event_loop().time()
+        if available:
+            self.failures //= 2
+        else:
+            self.failures += 1
+
+
+class ServerInventory:
+    """ Keeps the game server list and health up to date in the background.
+
+    Servers that are free are ranked per region flag by their health score,
+    so a match setup picks a candidate without scanning every server and
+    only probes the one it picked.
+    """
+
+    def __init__(self, api: "APIManager") -> None:
+        """"""
+        self.api = api
+        self.logger = logging.getLogger("API")
+        self.statuses: Dict[int, ServerStatus] = {}
+        self.refreshed_at = None
+        self._ranked: Dict[Optional[str], List[ServerStatus]] = {}
+        self._leases: Dict[int, float] = {}
+        self._refresh_lock = asyncio.Lock()
+        self._task = None
+
+    def start(self) -> None:
+        """ Start refreshing the inventory in the background. """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """ Stop the background refresh. """
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        """"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.logger.error(f"Failed to refresh the server inventory: {e}", exc_info=1)
+            await asyncio.sleep(Config.servers_refresh_interval)
+
+    async def refresh(self) -> None:
+        """ Reload the server list and probe every free server. """
+        async with self._refresh_lock:
+            servers = await self.api.get_servers()
+            statuses = {}
+            for server in servers:
+                status = self.statuses.get(server.id) or ServerStatus(server)
+                status.server = server
+                statuses[server.id] = status
+            self.statuses = statuses
+
+            semaphore = asyncio.Semaphore(Config.server_probe_concurrency)
+
+            async def probe(status: ServerStatus) -> None:
+                async with semaphore:
+                    await self.probe(status)
+
+            await asyncio.gather(*[
+                probe(status) for status in statuses.values() if not status.server.in_use
+            ])
+            self._rank()
+            self.refreshed_at = asyncio.get_event_loop().time()
+
+    async def probe(self, status: ServerStatus) -> bool:
+        """ Check the status of one server and record the result. """
+        start = asyncio.get_event_loop().time()
+        try:
+            is_available, _ = await asyncio.wait_for(
+                self.api.is_server_available(status.server.id), Config.server_probe_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Status probe of server #{status.server.id} timed out")
+            status.record(False, None)
+            return False
+        except Exception:
+            status.record(False, None)
+            return False
+
+        status.record(is_available, asyncio.get_event_loop().time() - start)
+        return is_available
+
+    def _rank(self) -> None:
+        """ Group the free servers per region flag, best score first. """
+        ranked = {None: []}
+        free = [s for s in self.statuses.values() if not s.server.in_use and s.available]
+        for status in sorted(free, key=lambda s: s.score):
+            ranked[None].append(status)
+            ranked.setdefault(status.server.flag, []).append(status)
+        self._ranked = ranked
+
+    def _is_leased(self, server_id: int) -> bool:
+        """"""
+        expires_at = self._leases.get(server_id)
+        return expires_at is not None and expires_at > asyncio.get_event_loop().time()
+
+    async def acquire(self, region: Optional[str]=None) -> Optional[Server]:
+        """ Lease the best free server of the region.
+
+        The best candidates are probed again, a few at a time. The server
+        picked is then reserved until the next refresh sees it in use, or
+        `release` is called. If no candidate answers, the inventory is
+        refreshed once and searched again.
+        """
+        refreshed = False
+        if self.refreshed_at is None:
+            await self.refresh()
+            refreshed = True
+
+        while True:
+            server = await self._acquire_ranked(region)
+            if server or refreshed:
+                return server
+            # The snapshot may predate servers freed since, look again.
+            refreshed = True
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.logger.error(f"Failed to refresh the server inventory: {e}", exc_info=1)
+                return
+
+    async def _acquire_ranked(self, region: Optional[str]) -> Optional[Server]:
+        """"""
+        candidates = [
+            status for status in self._ranked.get(region or None, [])
+            if not self._is_leased(status.server.id)
+        ]
+        batch_size = max(1, Config.server_probe_concurrency)
+        for idx in range(0, len(candidates), batch_size):
+            batch = candidates[idx:idx + batch_size]
+            # Reserve the batch while it is probed, so concurrent setups pick other servers.
+            for status in batch:
+                self._lease(status.server.id)
+            chosen = None
+            try:
+                results = await asyncio.gather(*[self.probe(status) for status in batch])
+                for status, available in zip(batch, results):
+                    if available and chosen is None:
+                        chosen = status
+            finally:
+                for status in batch:
+                    if status is not chosen:
+                        self.release(status.server.id)
+            if chosen:
+                return chosen.server
+        self._rank()
+
+    def _lease(self, server_id: int) -> None:
+        """"""
+        self._leases[server_id] = asyncio.get_event_loop().time() + 2 * Config.servers_refresh_interval
+
+    def release(self, server_id: int) -> None:
+        """ Give back a leased server that ended up not being used. """
+        self._leases.pop(server_id, None)
+
+
 async def start_request_log(session, ctx, params):
     """"""
     ctx.start = asyncio.get_event_loop().time()
@@ -173,7 +481,7 @@ async def end_request_log(session, ctx, params):
                 f'    Status: {params.response.status}\n'
                 f'    Reason: {params.response.reason}')
     try:
-        resp_json = await params.response.json()
+        resp_json = await params.response.json(loads=json_loads)
         logger.debug(f'Response JSON from {params.url}: {resp_json}')
     except Exception as e:
         pass
@@ -182,42 +490,358 @@ TRACE_CONFIG = aiohttp.TraceConfig()
 TRACE_CONFIG.on_request_start.append(start_request_log)
 TRACE_CONFIG.on_request_end.append(end_request_log)
 
+# Timeouts per endpoint, see `APIManager.endpoint` for how URLs map to endpoints.
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=5, sock_read=10)
+ENDPOINT_TIMEOUTS = {
+    '/api/matches': aiohttp.ClientTimeout(total=10, connect=3, sock_read=8),
+    '/api/mapstats': aiohttp.ClientTimeout(total=10, connect=3, sock_read=8),
+    '/api/servers': aiohttp.ClientTimeout(total=10, connect=3, sock_read=8),
+    '/api/teams': aiohttp.ClientTimeout(total=10, connect=3, sock_read=8),
+    '/api/playerstats': aiohttp.ClientTimeout(total=10, connect=3, sock_read=8),
+    # Large payloads
+    '/api/leaderboard': aiohttp.ClientTimeout(total=30, connect=5, sock_read=25),
+    '/api/seasons': aiohttp.ClientTimeout(total=20, connect=5, sock_read=15),
+}
+
+
+class PoolStats:
+    """ Connection pool counters collected through aiohttp tracing.
+
+    `in_flight` counts requests, the connections checked out of the pool
+    and the idle ones kept alive are read from the connector itself. aiohttp
+    has no public accessors for those, they are None if it stops exposing them.
+    """
+
+    def __init__(self) -> None:
+        """"""
+        self.in_flight = 0
+        self.queued = 0
+        self.created = 0
+        self.reused = 0
+
+    def as_dict(self, connector: aiohttp.TCPConnector=None) -> Dict[str, Any]:
+        """"""
+        opened = self.created + self.reused
+        acquired = getattr(connector, '_acquired', None)
+        conns = getattr(connector, '_conns', None)
+        try:
+            in_use = len(acquired) if acquired is not None else None
+            idle = sum(len(c) for c in conns.values()) if conns is not None else None
+        except (TypeError, AttributeError):
+            in_use = idle = None
+        return {
+            'in_flight': self.in_flight,
+            'in_use': in_use,
+            'idle': idle,
+            'queued': self.queued,
+            'created': self.created,
+            'reused': self.reused,
+            'reuse_ratio': round(self.reused / opened, 3) if opened else None,
+            'limit': connector.limit if connector else None,
+            'limit_per_host': connector.limit_per_host if connector else None,
+        }
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """ Trace config that keeps the counters up to date. """
+        trace_config = aiohttp.TraceConfig()
+
+        def counter(attr: str, step: int):
+            async def callback(session, ctx, params):
+                setattr(self, attr, getattr(self, attr) + step)
+            return callback
+
+        trace_config.on_request_start.append(counter('in_flight', 1))
+        trace_config.on_request_end.append(counter('in_flight', -1))
+        trace_config.on_request_exception.append(counter('in_flight', -1))
+        trace_config.on_connection_queued_start.append(counter('queued', 1))
+        trace_config.on_connection_queued_end.append(counter('queued', -1))
+        trace_config.on_connection_create_end.append(counter('created', 1))
+        trace_config.on_connection_reuseconn.append(counter('reused', 1))
+        return trace_config
+
+
+class LeaderboardSnapshot:
+    """ In-memory copy of the PUG leaderboard, indexed by Steam ID.
+
+    The leaderboard is downloaded in the background, so lookups only cost
+    one dict access per requested player.
+    """
+
+    def __init__(self, api: "APIManager") -> None:
+        """"""
+        self.api = api
+        self.logger = logging.getLogger("API")
+        self.players: Dict[str, dict] = {}
+        self.refreshed_at = None
+        self._refresh_lock = asyncio.Lock()
+        self._task = None
+        self._refresh_task = None
+        self._stale = False
+
+    def start(self) -> None:
+        """ Start refreshing the snapshot in the background. """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """ Stop the background refresh. """
+        tasks = [task for task in [self._task, self._refresh_task] if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self) -> None:
+        """"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.logger.error(f"Failed to refresh the leaderboard: {e}", exc_info=1)
+            await asyncio.sleep(Config.leaderboard_refresh_interval)
+
+    def invalidate(self) -> None:
+        """ Refresh the snapshot in the background, the current one is served until then. """
+        self._stale = True
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_stale())
+
+    async def _refresh_stale(self) -> None:
+        """"""
+        # Invalidations during a refresh may not be in its download, refresh again for them.
+        while self._stale:
+            self._stale = False
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.logger.error(f"Failed to refresh the leaderboard: {e}", exc_info=1)
+                return
+
+    async def refresh(self) -> None:
+        """ Download the leaderboard and replace the snapshot. """
+        async with self._refresh_lock:
+            started_at = asyncio.get_event_loop().time()
+            self.players = await self.api.fetch_leaderboard()
+            self.refreshed_at = started_at
+
+    async def get(self, steam_ids: List[str]) -> List[dict]:
+        """ Leaderboard entries of the given players, in the same order.
+
+        Players missing from the leaderboard get empty stats.
+        """
+        if self.refreshed_at is None:
+            await self.refresh()
+        return [
+            self.players.get(steam_id) or dict(EMPTY_PLAYERSTAT, steamId=steam_id)
+            for steam_id in steam_ids
+        ]
+
 
 class APIManager:
     """ Class to contain API request wrapper functions. """
 
     def __init__(self):
         self.logger = logging.getLogger("API")
+        self.inventory = ServerInventory(self)
+        self.leaderboard = LeaderboardSnapshot(self)
+        self.cache = TTLCache(Config.api_cache_size)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._cache_epoch = 0
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.stats = PoolStats()
+        self._stats_task = None
 
     def connect(self, loop):
         self.logger.info('Starting API helper client session')
+        connector = aiohttp.TCPConnector(
+            loop=loop,
+            limit=Config.api_connection_limit,
+            limit_per_host=Config.api_connection_limit_per_host,
+            keepalive_timeout=Config.api_keepalive_timeout,
+            ttl_dns_cache=Config.api_dns_cache_ttl
+        )
+        trace_configs = [self.stats.trace_config()]
+        if Config.debug:
+            trace_configs.append(TRACE_CONFIG)
         self.session = aiohttp.ClientSession(
             base_url=Config.base_url,
             loop=loop,
+            connector=connector,
             headers={"user-api": Config.api_key},
-            json_serialize=lambda x: json.dumps(x, ensure_ascii=False),
-            timeout=aiohttp.ClientTimeout(total=30),
-            trace_configs=[TRACE_CONFIG] if Config.debug else None
+            json_serialize=json_dumps,
+            timeout=DEFAULT_TIMEOUT,
+            trace_configs=trace_configs
         )
+        self.inventory.start()
+        self.leaderboard.start()
+        if self._stats_task is None or self._stats_task.done():
+            self._stats_task = asyncio.create_task(self._log_pool_stats())
 
     async def close(self):
         """ Close the API helper's session. """
         self.logger.info('Closing API helper client session')
+        await self.inventory.close()
+        await self.leaderboard.close()
+        if self._stats_task:
+            self._stats_task.cancel()
+            await asyncio.gather(self._stats_task, return_exceptions=True)
         await self.session.close()
 
+    def pool_stats(self) -> Dict[str, Any]:
+        """ Connection pool usage: connections in use and idle, queued acquisitions and reuse ratio. """
+        return self.stats.as_dict(self.session.connector)
+
+    async def _log_pool_stats(self) -> None:
+        """ Log the connection pool usage periodically. """
+        while True:
+            await asyncio.sleep(Config.api_pool_stats_interval)
+            self.logger.debug(f"Connection pool: {self.pool_stats()}")
+
+    @staticmethod
+    def endpoint(url: str) -> str:
+        """ Endpoint a URL belongs to, e.g. `/api/matches`. """
+        return '/' + '/'.join(url.strip('/').split('/')[:2])
+
+    @classmethod
+    def breaker_key(cls, url: str) -> str:
+        """ Circuit breaker key of a URL.
+
+        Server status probes get a breaker per server, so one dead game
+        server doesn't block the rest of `/api/servers`.
+        """
+        parts = url.strip('/').split('/')
+        if parts[:2] == ['api', 'servers'] and parts[-1] == 'status':
+            return '/' + '/'.join(parts)
+        return cls.endpoint(url)
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """ Circuit breaker of the endpoint a URL belongs to. """
+        key = self.breaker_key(url)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                key, Config.api_breaker_threshold, Config.api_breaker_reset_timeout)
+            self.breakers[key] = breaker
+        return breaker
+
+    def is_available(self, url: str) -> bool:
+        """ Whether requests to the endpoint of a URL are currently let through. """
+        return not self.breaker(url).is_open
+
+    @asynccontextmanager
+    async def _request(self, method: str, url: str, retry: bool=None, **kwargs):
+        """ Send a request through the circuit breaker of its endpoint.
+
+        Idempotent requests (GETs, unless `retry=False`) are retried with
+        exponential backoff on connection errors, timeouts and 5xx responses.
+        The breaker counts the outcome of the last attempt only, so a single
+        request can't open it by itself.
+        Raises `ValueError` without sending anything while the circuit is open.
+        Requests use the timeouts of their endpoint from `ENDPOINT_TIMEOUTS`.
+        """
+        if retry is None:
+            retry = method == 'GET'
+        attempts = Config.api_retries + 1 if retry else 1
+        breaker = self.breaker(url)
+        kwargs.setdefault('timeout', ENDPOINT_TIMEOUTS.get(self.endpoint(url), DEFAULT_TIMEOUT))
+
+        admitted = breaker.allow()
+        if not admitted:
+            raise ValueError(f"{breaker.name} is unavailable (circuit open)")
+        recorded = False
+        try:
+            for attempt in range(attempts):
+                last_attempt = attempt + 1 == attempts
+                try:
+                    resp = await self.session.request(method, url, **kwargs)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if last_attempt:
+                        breaker.record_failure(admitted)
+                        recorded = True
+                        raise
+                else:
+                    if resp.status < 500 or last_attempt:
+                        if resp.status >= 500:
+                            breaker.record_failure(admitted)
+                        else:
+                            breaker.record_success(admitted)
+                        recorded = True
+                        try:
+                            yield resp
+                        finally:
+                            resp.release()
+                        return
+                    resp.release()
+
+                delay = backoff_delay(attempt, Config.api_retry_backoff, Config.api_retry_backoff_max)
+                self.logger.warning(f"{method} {url} failed, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        finally:
+            if not recorded:
+                # Cancelled before an outcome, don't hold on to the half-open probe slot.
+                breaker.release(admitted)
+
+    async def _cached(self, key: tuple, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """ Return a cached response, or load it once for all concurrent callers.
+
+        `key` starts with the endpoint name, which selects the TTL from
+        `CACHE_TTLS`. `None` results are not cached.
+        """
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            epoch = self._cache_epoch
+
+            async def load():
+                result = await loader()
+                # Skip caching if a mutation invalidated the cache meanwhile.
+                if result is not None and epoch == self._cache_epoch:
+                    self.cache.set(key, result, CACHE_TTLS[key[0]])
+                return result
+
+            task = asyncio.create_task(load())
+            self._inflight[key] = task
+            task.add_done_callback(
+                lambda t: self._inflight.pop(key) if self._inflight.get(key) is t else None)
+
+        return await asyncio.shield(task)
+
+    def invalidate_match(self, match_id: int) -> None:
+        """ Forget cached data of a match after it was changed. """
+        self._cache_epoch += 1
+        for key in [('match', match_id), ('mapstats', match_id)]:
+            self.cache.invalidate(key)
+            self._inflight.pop(key, None)
+
+    def invalidate_team(self, team_id: int=None) -> None:
+        """ Forget cached data of a team, or of every team. """
+        self._cache_epoch += 1
+        if team_id is None:
+            self.cache.invalidate_endpoint('team')
+            for key in [k for k in self._inflight if k[0] == 'team']:
+                self._inflight.pop(key, None)
+        else:
+            self.cache.invalidate(('team', team_id))
+            self._inflight.pop(('team', team_id), None)
+
     async def get_team(self, team_id: int) -> Optional[Team]:
         """"""
-        url = f"/api/teams/{team_id}"
+        async def load():
+            url = f"/api/teams/{team_id}"
 
-        try:
-            async with self.session.get(url=url) as resp:
-                resp_data = await resp.json()
-                if not resp.ok:
-                    return
-                return Team.from_dict(resp_data['team'])
-        except Exception as e:
-            self.logger.error(e, exc_info=1)
-            raise APIError
+            try:
+                async with self._request('GET', url) as resp:
+                    resp_data = await resp.json(loads=json_loads)
+                    if not resp.ok:
+                        return
+                    return Team.from_dict(resp_data['team'])
+            except Exception as e:
+                self.logger.error(e, exc_info=1)
+                raise APIError
+
+        return await self._cached(('team', team_id), load)
 
     async def create_team(self, name: str, users_dict: Dict[str, Dict[str, bool]]):
         """"""
@@ -232,10 +856,10 @@ class APIManager:
         }
 
         try:
-            async with self.session.post(url=url, json=[data]) as resp:
+            async with self._request('POST', url, json=[data]) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key.")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     raise ValueError(resp_data['message'])
                 return resp_data['id']
@@ -249,16 +873,18 @@ class APIManager:
         data = {'team_id': team_id}
 
         try:
-            async with self.session.delete(url=url, json=[data]) as resp:
+            async with self._request('DELETE', url, json=[data]) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_team(team_id)
 
     async def add_team_member(self, team_id: int, user_dict: Dict[str, Dict[str, bool]]):
         """"""
@@ -269,16 +895,18 @@ class APIManager:
         }
 
         try:
-            async with self.session.put(url=url, json=[data]) as resp:
+            async with self._request('PUT', url, json=[data]) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_team(team_id)
 
     async def remove_team_member(self, team_id: int, steam_id: str):
         """"""
@@ -289,41 +917,46 @@ class APIManager:
         }
 
         try:
-            async with self.session.delete(url=url, json=[data]) as resp:
+            async with self._request('DELETE', url, json=[data]) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_team(team_id)
 
     async def get_server(self, server_id: int):
         """"""
-        url = f"/api/servers/{server_id}"
-
-        try:
-            async with self.session.get(url=url) as resp:
-                if "/auth/steam" in str(resp.url):
-                    raise ValueError("Invalid API key")
-                resp_data = await resp.json()
-                if not resp.ok:
-                    raise ValueError(resp_data['message'])
-                return Server.from_dict(resp_data['server'])
-        except Exception as e:
-            self.logger.error(e, exc_info=1)
-            raise APIError
+        async def load():
+            url = f"/api/servers/{server_id}"
+
+            try:
+                async with self._request('GET', url) as resp:
+                    if "/auth/steam" in str(resp.url):
+                        raise ValueError("Invalid API key")
+                    resp_data = await resp.json(loads=json_loads)
+                    if not resp.ok:
+                        raise ValueError(resp_data['message'])
+                    return Server.from_dict(resp_data['server'])
+            except Exception as e:
+                self.logger.error(e, exc_info=1)
+                raise APIError
+
+        return await self._cached(('server', server_id), load)
 
     async def get_servers(self):
         """"""
         url = "/api/servers/myservers"
         try:
-            async with self.session.get(url=url) as resp:
+            async with self._request('GET', url) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     raise ValueError(resp_data['message'])
                 return [Server.from_dict(server) for server in resp_data['servers']]
@@ -336,10 +969,10 @@ class APIManager:
         url = f"/api/servers/{server_id}/status"
 
         try:
-            async with self.session.get(url=url) as resp:
+            async with self._request('GET', url, retry=False) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
@@ -363,8 +996,8 @@ class APIManager:
         url = f"/api/playerstats/{user_model.steam}/pug"
 
         try:
-            async with self.session.get(url=url) as resp:
-                resp_data = await resp.json()
+            async with self._request('GET', url) as resp:
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return
                 resp_data["playerstats"]["name"] = user.display_name
@@ -373,9 +1006,24 @@ class APIManager:
             self.logger.error(e, exc_info=1)
             raise APIError
 
+    async def fetch_leaderboard(self) -> Dict[str, dict]:
+        """ Download the PUG leaderboard, keyed by Steam ID. """
+
+        url = "/api/leaderboard/players/pug"
+
+        try:
+            async with self._request('GET', url) as resp:
+                resp_data = await resp.json(loads=json_loads)
+                if not resp.ok:
+                    raise ValueError(resp_data.get('message'))
+                return {player['steamId']: player for player in resp_data['leaderboard']}
+        except Exception as e:
+            self.logger.error(e, exc_info=1)
+            raise APIError
+
     async def get_leaderboard(self, users: List[Member]) -> List[PlayerStat]:
         """
-        Retrieve players stats from the PUG leaderboard API and matches them to the given list of discord.Member.
+        Retrieve players stats from the PUG leaderboard snapshot and matches them to the given list of discord.Member.
 
         Args:
         - users: A list of discord.Member objects.
@@ -384,55 +1032,46 @@ class APIManager:
         - A list of PlayerStat objects.
         """
 
-        url = "/api/leaderboard/players/pug"
-
         users_model = await db.get_users(users)
-        db_steam_ids = [usr.steam for usr in users_model]
+        players = await self.leaderboard.get([usr.steam for usr in users_model])
 
-        try:
-            async with self.session.get(url=url) as resp:
-                resp_data = await resp.json()
-                if not resp.ok:
-                    return []
-                players = list(
-                    filter(lambda x: x['steamId'] in db_steam_ids, resp_data['leaderboard']))
-                api_steam_ids = [player['steamId'] for player in players]
-
-                for steam_id in db_steam_ids:
-                    if steam_id not in api_steam_ids:
-                        players.append({
-                            "steamId": steam_id,
-                            "kills": 0,
-                            "deaths": 0,
-                            "assists": 0,
-                            "k1": 0,
-                            "k2": 0,
-                            "k3": 0,
-                            "k4": 0,
-                            "k5": 0,
-                            "v1": 0,
-                            "v2": 0,
-                            "v3": 0,
-                            "v4": 0,
-                            "v5": 0,
-                            "trp": 0,
-                            "fba": 0,
-                            "total_damage": 0,
-                            "hsk": 0,
-                            "hsp": 0.00,
-                            "average_rating": 0.00,
-                            "wins": 0,
-                            "total_maps": 0
-                        })
-
-                players.sort(key=lambda x: db_steam_ids.index(x['steamId']))
-                for idx, db_user in enumerate(users_model):
-                    players[idx]['name'] = db_user.user.display_name
-
-                return [PlayerStat.from_dict(player) for player in players]
-        except Exception as e:
-            self.logger.error(e, exc_info=1)
-            raise APIError
+        return [
+            PlayerStat.from_dict(dict(player, name=usr.user.display_name))
+            for usr, player in zip(users_model, players)
+        ]
+
+    async def get_top_players(self, guild: Guild, limit: int=10) -> List[PlayerStat]:
+        """
+        Retrieve the best rated linked players of a guild from the PUG leaderboard snapshot.
+
+        Linked users are ranked by rating with a heap, and only resolved to guild
+        members while popping it, so at most `limit` members plus the ones that
+        left the guild are looked up.
+
+        Args:
+        - guild: The guild to rank the members of.
+        - limit: Number of players to return.
+
+        Returns:
+        - A list of PlayerStat objects, best rated first.
+        """
+
+        linked_users = await db.get_linked_users()
+        players = await self.leaderboard.get(list(linked_users))
+        heap = [
+            (-float(player["average_rating"]), steam_id, player)
+            for steam_id, player in zip(linked_users, players)
+        ]
+        heapq.heapify(heap)
+
+        top_players = []
+        while heap and len(top_players) < limit:
+            _, steam_id, player = heapq.heappop(heap)
+            member = guild.get_member(linked_users[steam_id])
+            if member:
+                top_players.append(PlayerStat.from_dict(dict(player, name=member.display_name)))
+
+        return top_players
 
     async def get_mapstats(self, match_id: int):
         """
@@ -448,17 +1087,20 @@ class APIManager:
         - `APIError`: If an error occurs while fetching the map statistics.
         """
 
-        url = f"/api/mapstats/{match_id}"
+        async def load():
+            url = f"/api/mapstats/{match_id}"
 
-        try:
-            async with self.session.get(url=url) as resp:
-                resp_data = await resp.json()
-                if not resp.ok:
-                    return []
-                return [MapStat.from_dict(map_stat) for map_stat in resp_data['mapstats']]
-        except Exception as e:
-            self.logger.error(e, exc_info=1)
-            raise APIError
+            try:
+                async with self._request('GET', url) as resp:
+                    resp_data = await resp.json(loads=json_loads)
+                    if not resp.ok:
+                        return []
+                    return [MapStat.from_dict(map_stat) for map_stat in resp_data['mapstats']]
+            except Exception as e:
+                self.logger.error(e, exc_info=1)
+                raise APIError
+
+        return await self._cached(('mapstats', match_id), load)
 
     async def get_match(self, match_id: int) -> Optional["Match"]:
         """
@@ -475,17 +1117,20 @@ class APIManager:
         - `APIError`: If an error occurs while fetching the match.
         """
 
-        url = f"/api/matches/{match_id}"
+        async def load():
+            url = f"/api/matches/{match_id}"
 
-        try:
-            async with self.session.get(url=url) as resp:
-                resp_data = await resp.json()
-                if not resp.ok:
-                    return
-                return Match.from_dict(resp_data["match"])
-        except Exception as e:
-            self.logger.error(e, exc_info=1)
-            raise APIError
+            try:
+                async with self._request('GET', url) as resp:
+                    resp_data = await resp.json(loads=json_loads)
+                    if not resp.ok:
+                        return
+                    return Match.from_dict(resp_data["match"])
+            except Exception as e:
+                self.logger.error(e, exc_info=1)
+                raise APIError
+
+        return await self._cached(('match', match_id), load)
         
     async def create_match(
         self,
@@ -547,10 +1192,10 @@ class APIManager:
         }
 
         try:
-            async with self.session.post(url=url, json=[data]) as resp:
+            async with self._request('POST', url, json=[data]) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     raise ValueError(resp_data['message'])
                 return resp_data['id']
@@ -575,16 +1220,18 @@ class APIManager:
         url = f"/api/matches/{match_id}/cancel"
 
         try:
-            async with self.session.get(url=url) as resp:
+            async with self._request('GET', url, retry=False) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_match(match_id)
         
     async def forfeit_match(self, match_id: int, winner: Literal[1, 2]):
         """"""
@@ -592,16 +1239,18 @@ class APIManager:
         url = f"/api/matches/{match_id}/forfeit/{winner}"
 
         try:
-            async with self.session.get(url=url) as resp:
+            async with self._request('GET', url, retry=False) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_match(match_id)
 
     async def restart_match(self, match_id: int):
         """
@@ -620,16 +1269,18 @@ class APIManager:
         url = f"/api/matches/{match_id}/restart"
 
         try:
-            async with self.session.get(url=url) as resp:
+            async with self._request('GET', url, retry=False) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_match(match_id)
         
     async def pause_match(self, match_id: int):
         """
@@ -648,16 +1299,18 @@ class APIManager:
         url = f"/api/matches/{match_id}/pause"
 
         try:
-            async with self.session.get(url=url) as resp:
+            async with self._request('GET', url, retry=False) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_match(match_id)
 
     async def unpause_match(self, match_id: int) -> bool:
         """
@@ -676,16 +1329,18 @@ class APIManager:
         url = f"/api/matches/{match_id}/unpause"
 
         try:
-            async with self.session.get(url=url) as resp:
+            async with self._request('GET', url, retry=False) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_match(match_id)
 
     async def add_match_player(
         self,
@@ -720,16 +1375,20 @@ class APIManager:
         }
 
         try:
-            async with self.session.put(url=url, json=[data]) as resp:
+            async with self._request('PUT', url, json=[data]) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_match(match_id)
+            # G5API also updates the auth names of the player's team.
+            self.invalidate_team()
 
     async def remove_match_player(self, match_id: int, steam_id: str):
         """
@@ -750,30 +1409,37 @@ class APIManager:
         data = {'steam_id': steam_id}
 
         try:
-            async with self.session.put(url=url, json=[data]) as resp:
+            async with self._request('PUT', url, json=[data]) as resp:
                 if "/auth/steam" in str(resp.url):
                     raise ValueError("Invalid API key")
-                resp_data = await resp.json()
+                resp_data = await resp.json(loads=json_loads)
                 if not resp.ok:
                     return False, resp_data["message"]
                 return True, resp_data["message"]
         except Exception as e:
             self.logger.error(e, exc_info=1)
             raise APIError
+        finally:
+            self.invalidate_match(match_id)
+            # G5API also updates the auth names of the player's team.
+            self.invalidate_team()
         
     async def get_season(self, season_id: int):
         """"""
-        url = f"/api/seasons/{season_id}"
+        async def load():
+            url = f"/api/seasons/{season_id}"
+
+            try:
+                async with self._request('GET', url) as resp:
+                    resp_data = await resp.json(loads=json_loads)
+                    if not resp.ok:
+                        return
+                    return Season.from_dict(resp_data["season"], resp_data["matches"])
+            except Exception as e:
+                self.logger.error(e, exc_info=1)
+                raise APIError
+
+        return await self._cached(('season', season_id), load)
 
-        try:
-            async with self.session.get(url=url) as resp:
-                resp_data = await resp.json()
-                if not resp.ok:
-                    return
-                return Season.from_dict(resp_data["season"], resp_data["matches"])
-        except Exception as e:
-            self.logger.error(e, exc_info=1)
-            raise APIError
-                
 
 api = APIManager()
@@ -0,0 +1,75 @@
+# bot/helpers/balance.py
+
+import itertools
+import time
+from typing import List, Sequence, Tuple
+
+
+Split = Tuple[List[int], List[int]]
+
+
+def greedy_balance(ratings: Sequence[float]) -> Split:
+    """ Split players by handing the next best player to the weaker team.
+
+    This is the former autobalance strategy, kept as a fast baseline and
+    as the starting point of `balance_teams`.
+    """
+    order = sorted(range(len(ratings)), key=lambda i: ratings[i], reverse=True)
+    team_size = len(order) // 2
+    team1, team2 = [order[0]], [order[1]]
+    team1_sum, team2_sum = ratings[order[0]], ratings[order[1]]
+
+    for idx in order[2:]:
+        if len(team1) >= team_size or (len(team2) < team_size and team1_sum >= team2_sum):
+            team2.append(idx)
+            team2_sum += ratings[idx]
+        else:
+            team1.append(idx)
+            team1_sum += ratings[idx]
+
+    return team1, team2
+
+
+def balance_teams(ratings: Sequence[float], time_budget: float=0.5) -> Split:
+    """ Split players into two teams with the smallest rating difference.
+
+    Every split is scored, with the first player pinned to the first team
+    so mirrored splits are skipped (126 splits for 10 players). The search
+    starts from the greedy split and stops early on a perfect split or once
+    the time budget runs out.
+
+    Args:
+    - ratings: Rating of each player.
+    - time_budget: Seconds after which the best split found so far is returned.
+
+    Returns:
+    - The player indexes of both teams.
+    """
+    count = len(ratings)
+    if count < 2:
+        return list(range(count)), []
+
+    team_size = count // 2
+    total = sum(ratings)
+    greedy_team1, _ = greedy_balance(ratings)
+    best = sum(1 << idx for idx in greedy_team1)
+    best_diff = abs(total - 2 * sum(ratings[idx] for idx in greedy_team1))
+
+    deadline = time.perf_counter() + time_budget
+    for checked, rest in enumerate(itertools.combinations(range(1, count), team_size - 1)):
+        if checked % 256 == 0 and time.perf_counter() > deadline:
+            break
+        mask = 1
+        team_sum = ratings[0]
+        for idx in rest:
+            mask |= 1 << idx
+            team_sum += ratings[idx]
+        diff = abs(total - 2 * team_sum)
+        if diff < best_diff:
+            best, best_diff = mask, diff
+            if diff == 0:
+                break
+
+    team1 = [idx for idx in range(count) if best >> idx & 1]
+    team2 = [idx for idx in range(count) if not best >> idx & 1]
+    return team1, team2
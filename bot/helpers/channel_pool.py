@@ -0,0 +1,204 @@
+# bot/helpers/channel_pool.py
+
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import discord
+
+from bot.helpers.db import db
+from bot.helpers.dispatcher import ActionDispatcher, PRIORITY_CHANNEL, PRIORITY_BACKGROUND
+
+
+MatchChannels = Tuple[discord.CategoryChannel, discord.VoiceChannel, discord.VoiceChannel]
+
+FREE_CATEGORY_NAME = "Match (free)"
+
+# Discord allows two renames per channel every 10 minutes.
+RENAME_LIMIT = 2
+RENAME_WINDOW = 600
+
+
+class ChannelPool:
+    """ Per-guild pool of hidden match categories holding two team voice channels.
+
+    Leasing a set renames it and swaps its overwrites instead of creating
+    three channels, and releasing it hides it again instead of deleting it.
+    Released sets keep their names, since Discord only allows two renames
+    per channel every 10 minutes, and the set released the longest ago is
+    leased first. A channel out of renames keeps its name rather than
+    stalling the lease on the rate limit. Pools are topped up to `size` in
+    the background. Every channel call goes through the bot's dispatcher.
+    """
+
+    def __init__(self, size: int, dispatcher: ActionDispatcher):
+        """"""
+        self.size = size
+        self.dispatcher = dispatcher
+        self.logger = logging.getLogger('Bot')
+        self._top_ups: Dict[int, asyncio.Task] = {}
+        self._renames: Dict[int, Deque[float]] = defaultdict(lambda: deque(maxlen=RENAME_LIMIT))
+
+    @staticmethod
+    def hidden_overwrites(guild: discord.Guild) -> dict:
+        """"""
+        return {
+            guild.default_role: discord.PermissionOverwrite(view_channel=False),
+            guild.me: discord.PermissionOverwrite(view_channel=True, connect=True)
+        }
+
+    async def lease(
+        self,
+        guild: discord.Guild,
+        match_id: int,
+        team_names: Tuple[str, str],
+        team_overwrites: Tuple[dict, dict]
+    ) -> Optional[MatchChannels]:
+        """ Set up a pooled channel set for a match, or return None if the pool is empty. """
+        if self.size <= 0:
+            return
+
+        try:
+            while True:
+                data = await db.pop_pooled_channels(guild.id)
+                if not data:
+                    return
+
+                channels = (
+                    guild.get_channel(data['category']),
+                    guild.get_channel(data['team1_channel']),
+                    guild.get_channel(data['team2_channel'])
+                )
+                if not all(channels):
+                    # Deleted by hand, drop what is left of it.
+                    await self.delete(*channels)
+                    continue
+
+                category, team1_channel, team2_channel = channels
+                try:
+                    await asyncio.gather(
+                        self._submit('edit_channel', guild, lambda: self._edit(category, f"Match #{match_id}", {})),
+                        self._submit('edit_channel', guild, lambda: self._edit(
+                            team1_channel, f"Team {team_names[0]}", team_overwrites[0], "Team 1")),
+                        self._submit('edit_channel', guild, lambda: self._edit(
+                            team2_channel, f"Team {team_names[1]}", team_overwrites[1], "Team 2"))
+                    )
+                except Exception as e:
+                    # Don't leave a half set up channel set around, new channels are created instead.
+                    self.logger.error(f"Failed to lease pooled channels for match #{match_id}: {e}", exc_info=1)
+                    await self.delete(*channels)
+                    return
+                return category, team1_channel, team2_channel
+        finally:
+            self.top_up(guild)
+
+    async def release(
+        self,
+        category: discord.CategoryChannel,
+        team1_channel: discord.VoiceChannel,
+        team2_channel: discord.VoiceChannel
+    ) -> bool:
+        """ Hide a match's channels so they can go back to the pool.
+
+        They only join the pool once the match row is deleted, see
+        `db.delete_match`. Returns False if the pool is full, the channels
+        are then left to the caller.
+        """
+        guild = category.guild
+        if self.size <= 0 or await db.count_pooled_channels(guild.id) >= self.size:
+            return False
+
+        overwrites = self.hidden_overwrites(guild)
+        await asyncio.gather(*[
+            self._submit('edit_channel', guild, lambda channel=channel: channel.edit(overwrites=overwrites))
+            for channel in [category, team1_channel, team2_channel]
+        ])
+        return True
+
+    async def delete(self, *channels: Optional[discord.abc.GuildChannel]) -> None:
+        """ Delete channels, skipping the ones that are already gone.
+
+        Failures are logged and don't stop the remaining deletions.
+        """
+        for channel in channels:
+            if channel:
+                self._renames.pop(channel.id, None)
+                try:
+                    await self._submit('delete_channel', channel.guild, channel.delete)
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException as e:
+                    self.logger.warning(f"Failed to delete channel {channel.id}: {e}")
+
+    def top_up(self, guild: discord.Guild) -> None:
+        """ Fill the guild's pool up to its size in the background. """
+        task = self._top_ups.get(guild.id)
+        if self.size > 0 and (task is None or task.done()):
+            self._top_ups[guild.id] = asyncio.create_task(self._top_up(guild))
+
+    async def close(self) -> None:
+        """"""
+        tasks = list(self._top_ups.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _top_up(self, guild: discord.Guild) -> None:
+        """"""
+        try:
+            count = await db.count_pooled_channels(guild.id)
+            for _ in range(self.size - count):
+                overwrites = self.hidden_overwrites(guild)
+                category = await self._submit(
+                    'create_channel', guild,
+                    lambda: guild.create_category_channel(FREE_CATEGORY_NAME, overwrites=overwrites),
+                    PRIORITY_BACKGROUND
+                )
+                team1_channel, team2_channel = await asyncio.gather(*[
+                    self._submit(
+                        'create_channel', guild,
+                        lambda name=name: guild.create_voice_channel(name, category=category, overwrites=overwrites),
+                        PRIORITY_BACKGROUND
+                    )
+                    for name in ["Team 1", "Team 2"]
+                ])
+                await db.insert_pooled_channels(guild.id, category.id, team1_channel.id, team2_channel.id)
+        except Exception as e:
+            self.logger.error(f"Failed to top up the channel pool of guild {guild.id}: {e}", exc_info=1)
+
+    def _submit(
+        self,
+        route: str,
+        guild: discord.Guild,
+        factory: Callable[[], Awaitable[Any]],
+        priority: int=PRIORITY_CHANNEL
+    ) -> asyncio.Future:
+        """"""
+        return self.dispatcher.submit(route, guild.id, factory, priority)
+
+    async def _edit(
+        self,
+        channel: discord.abc.GuildChannel,
+        name: str,
+        overwrites: dict,
+        fallback_name: str=None
+    ) -> None:
+        """ Rename a channel and replace its overwrites, renaming only if the name changed. """
+        if channel.name == name or not self._can_rename(channel):
+            await channel.edit(overwrites=overwrites)
+            return
+        self._renames[channel.id].append(time.monotonic())
+        try:
+            await channel.edit(name=name, overwrites=overwrites)
+        except discord.HTTPException as e:
+            if e.code != 50035 or not fallback_name:
+                raise
+            self.logger.warning(e)
+            await channel.edit(name=fallback_name, overwrites=overwrites)
+
+    def _can_rename(self, channel: discord.abc.GuildChannel) -> bool:
+        """ Whether a channel has a rename left in the current rate limit window. """
+        renames = self._renames[channel.id]
+        return len(renames) < RENAME_LIMIT or time.monotonic() - renames[0] >= RENAME_WINDOW
@@ -19,10 +19,36 @@ class Config:
     sync_commands_globally = config['bot']['sync_commands_globally']
     debug = config['bot']['debug']
     maps = config['bot']['maps']
+    match_setup_workers = config['bot'].get('match_setup_workers', 4)
+    server_probe_concurrency = config['bot'].get('server_probe_concurrency', 5)
+    server_probe_timeout = config['bot'].get('server_probe_timeout', 5)
+    match_poll_concurrency = config['bot'].get('match_poll_concurrency', 10)
+    voice_move_concurrency = config['bot'].get('voice_move_concurrency', 5)
+    channel_pool_size = config['bot'].get('channel_pool_size', 2)
+    dispatch_guild_concurrency = config['bot'].get('dispatch_guild_concurrency', 10)
     base_url = config['web']['base_url']
     api_key = config['web']['api_key']
+    servers_refresh_interval = config['web'].get('servers_refresh_interval', 60)
+    api_cache_size = config['web'].get('cache_size', 1024)
+    leaderboard_refresh_interval = config['web'].get('leaderboard_refresh_interval', 120)
+    api_retries = config['web'].get('retries', 2)
+    api_retry_backoff = config['web'].get('retry_backoff', 0.5)
+    api_retry_backoff_max = config['web'].get('retry_backoff_max', 5)
+    api_breaker_threshold = config['web'].get('breaker_threshold', 5)
+    api_breaker_reset_timeout = config['web'].get('breaker_reset_timeout', 30)
+    api_connection_limit = config['web'].get('connection_limit', 100)
+    api_connection_limit_per_host = config['web'].get('connection_limit_per_host', 30)
+    api_keepalive_timeout = config['web'].get('keepalive_timeout', 30)
+    api_dns_cache_ttl = config['web'].get('dns_cache_ttl', 300)
+    api_pool_stats_interval = config['web'].get('pool_stats_interval', 60)
+    events_enabled = config.get('events', {}).get('enabled', False)
+    events_host = config.get('events', {}).get('host', '127.0.0.1')
+    events_port = config.get('events', {}).get('port', 8080)
+    events_secret = config.get('events', {}).get('secret', '')
+    events_poll_interval = config.get('events', {}).get('poll_interval', 120)
     POSTGRESQL_USER = config['db']['user']
     POSTGRESQL_PASSWORD = config['db']['password']
     POSTGRESQL_DB = config['db']['database']
     POSTGRESQL_HOST = config['db']['host']
     POSTGRESQL_PORT = config['db']['port']
+    POSTGRESQL_STATEMENT_CACHE_SIZE = config['db'].get('statement_cache_size', 100)
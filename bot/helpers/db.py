@@ -2,7 +2,8 @@
 
 import asyncpg
 import logging
-from typing import List, Union, Optional
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple, Union, Optional
 
 import discord
 
@@ -21,7 +22,10 @@ class DBManager:
         """"""
         self.logger.info("Creating database connection pool.")
         db_connect_url = f'postgresql://{Config.POSTGRESQL_USER}:{Config.POSTGRESQL_PASSWORD}@{Config.POSTGRESQL_HOST}:{Config.POSTGRESQL_PORT}/{Config.POSTGRESQL_DB}'
-        self.db_pool = await asyncpg.create_pool(db_connect_url)
+        self.db_pool = await asyncpg.create_pool(
+            db_connect_url,
+            statement_cache_size=Config.POSTGRESQL_STATEMENT_CACHE_SIZE
+        )
 
     async def close(self) -> None:
         """"""
@@ -29,12 +33,42 @@ class DBManager:
         await self.db_pool.close()
 
     async def query(self, sql, *args) -> List[dict]:
-        """"""
-        async with self.db_pool.acquire() as connection:
-            async with connection.transaction():
-                prepared_stmt = await connection.prepare(sql)
-                result = await prepared_stmt.fetch(*args)
-                return [dict(row.items()) for row in result]
+        """ Run a statement and return all resulting rows.
+
+        Single statements run in autocommit mode and go through the
+        connection's prepared statement cache, so repeated queries skip
+        both the prepare round trip and BEGIN/COMMIT.
+        """
+        result = await self.db_pool.fetch(sql, *args)
+        return [dict(row.items()) for row in result]
+
+    async def fetchrow(self, sql, *args) -> Optional[dict]:
+        """ Run a statement and return its first row, if any. """
+        row = await self.db_pool.fetchrow(sql, *args)
+        if row is not None:
+            return dict(row.items())
+
+    async def execute(self, sql, *args) -> str:
+        """ Run a statement that returns no rows and return its status. """
+        return await self.db_pool.execute(sql, *args)
+
+    async def insert_many(
+        self,
+        table: str,
+        columns: Sequence[str],
+        types: Sequence[str],
+        rows: Iterable[Tuple]
+    ) -> str:
+        """ Insert rows in one round trip by passing one array parameter per column.
+
+        The statement text only depends on the table and columns, so it is
+        prepared once per connection whatever the number of rows.
+        """
+        params = ", ".join(f"${idx}::{col_type}[]" for idx, col_type in enumerate(types, start=1))
+        sql = f"INSERT INTO {table} ({', '.join(columns)})\n" \
+            f"    SELECT * FROM unnest({params});"
+        values = [list(col) for col in zip(*rows)] or [[] for _ in columns]
+        return await self.execute(sql, *values)
 
     async def sync_guilds(self, guild_ids: List[int]) -> None:
         """"""
@@ -58,11 +92,11 @@ class DBManager:
         """"""
         sql = "SELECT * FROM matches\n" \
             f"    WHERE id = $1;"
-        data = await self.query(sql, match_id)
+        data = await self.fetchrow(sql, match_id)
         if data:
-            guild = bot.get_guild(data[0]['guild'])
+            guild = bot.get_guild(data['guild'])
             if guild:
-                return MatchModel.from_dict(data[0], guild)
+                return MatchModel.from_dict(data, guild)
 
     async def get_guild_matches(self, guild: discord.Guild) -> List["MatchModel"]:
         """"""
@@ -71,15 +105,26 @@ class DBManager:
         matches_data = await self.query(sql, guild.id)
         return [MatchModel.from_dict(data, guild) for data in matches_data]
 
+    async def get_live_matches(self, bot) -> Dict[discord.Guild, List["MatchModel"]]:
+        """ Get the matches of every guild the bot is in, grouped by guild. """
+        sql = "SELECT * FROM matches;"
+        matches_data = await self.query(sql)
+        guild_matches = defaultdict(list)
+        for data in matches_data:
+            guild = bot.get_guild(data['guild'])
+            if guild:
+                guild_matches[guild].append(MatchModel.from_dict(data, guild))
+        return dict(guild_matches)
+
     async def get_user_match(self, user_id: int, guild: discord.Guild) -> Optional["MatchModel"]:
         """"""
         sql = "SELECT m.* FROM match_users mu\n" \
             "JOIN matches m\n" \
             "    ON mu.match_id = m.id AND m.guild = $1\n" \
             "WHERE mu.user_id = $2;"
-        data = await self.query(sql, guild.id, user_id)
+        data = await self.fetchrow(sql, guild.id, user_id)
         if data:
-            return MatchModel.from_dict(data[0], guild)
+            return MatchModel.from_dict(data, guild)
 
     async def insert_match(self, data: dict) -> None:
         """"""
@@ -87,25 +132,43 @@ class DBManager:
         vals = ", ".join(str(val) for val in data.values())
         sql = f"INSERT INTO matches ({cols})\n" \
             f"    VALUES({vals});"
-        await self.query(sql)
+        await self.execute(sql)
 
     async def insert_match_users(self, match_id: int, users: List[discord.Member]) -> None:
         """"""
-        values = f", ".join(
-            f"({match_id}, {user.id})" for user in users)
-        sql = f"INSERT INTO match_users VALUES {values};"
-        await self.query(sql)
+        await self.insert_many(
+            'match_users', ('match_id', 'user_id'), ('INTEGER', 'BIGINT'),
+            [(match_id, user.id) for user in users]
+        )
 
     async def delete_match_user(self, match_id: int, user: discord.Member) -> None:
         """"""
         sql = "DELETE FROM match_users\n" \
             f"    WHERE match_id = $1 AND user_id = $2;"
-        await self.query(sql, match_id, user.id)
-
-    async def delete_match(self, match_id: int) -> None:
-        """"""
-        sql = f"DELETE FROM matches WHERE id = $1;"
-        await self.query(sql, match_id)
+        await self.execute(sql, match_id, user.id)
+
+    async def set_match_finished(self, match_id: int) -> None:
+        """ Flag a match whose teardown started, so it resumes after a restart. """
+        sql = "UPDATE matches SET finished = TRUE WHERE id = $1;"
+        await self.execute(sql, match_id)
+
+    async def delete_match(self, match_id: int, pool_channels: bool=False) -> None:
+        """ Delete a match, optionally putting its channels in the channel pool.
+
+        Both happen in one statement, so pooled channels never still belong
+        to a match whose teardown could resume.
+        """
+        if not pool_channels:
+            sql = f"DELETE FROM matches WHERE id = $1;"
+        else:
+            sql = "WITH deleted AS (\n" \
+                "    DELETE FROM matches WHERE id = $1\n" \
+                "    RETURNING guild, category, team1_channel, team2_channel\n" \
+                ")\n" \
+                "INSERT INTO channel_pool (guild, category, team1_channel, team2_channel)\n" \
+                "    SELECT guild, category, team1_channel, team2_channel FROM deleted\n" \
+                "    ON CONFLICT (category) DO NOTHING;"
+        await self.execute(sql, match_id)
 
     async def get_match_users(self, match_id: int, guild: discord.Guild) -> List[discord.Member]:
         """"""
@@ -124,19 +187,19 @@ class DBManager:
         """"""
         sql = "SELECT * FROM users\n" \
             f"    WHERE discord_id = $1;"
-        data = await self.query(sql, user_id)
+        data = await self.fetchrow(sql, user_id)
         if data:
             user = bot.get_user(user_id)
-            return UserModel.from_dict(data[0], user)
+            return UserModel.from_dict(data, user)
 
     async def get_user_by_steam_id(self, steam_id: str, bot) -> Optional["UserModel"]:
         """"""
         sql = "SELECT * FROM users\n" \
             f"    WHERE steam_id = $1;"
-        data = await self.query(sql, steam_id)
+        data = await self.fetchrow(sql, steam_id)
         if data:
-            user = bot.get_user(data[0]['discord_id'])
-            return UserModel.from_dict(data[0], user)
+            user = bot.get_user(data['discord_id'])
+            return UserModel.from_dict(data, user)
 
     async def get_users(self, users: List[discord.Member]) -> List["UserModel"]:
         """"""
@@ -144,14 +207,14 @@ class DBManager:
         sql = "SELECT * FROM users\n" \
             "    WHERE discord_id = ANY($1::BIGINT[]) AND steam_id IS NOT NULL;"
         users_data = await self.query(sql, users_ids)
-        db_user_ids = [u['discord_id'] for u in users_data]
-        filtered_users = list(filter(lambda x: x.id in db_user_ids, users))
-        return_obj = []
-        for user in filtered_users:
-            for data in users_data:
-                if user.id == data['discord_id']:
-                    return_obj.append(UserModel.from_dict(data, user))
-        return return_obj
+        rows = {data['discord_id']: data for data in users_data}
+        return [UserModel.from_dict(rows[user.id], user) for user in users if user.id in rows]
+
+    async def get_linked_users(self) -> Dict[str, int]:
+        """ Discord ID of every linked user, keyed by Steam ID. """
+        sql = "SELECT discord_id, steam_id FROM users WHERE steam_id IS NOT NULL;"
+        rows = await self.query(sql)
+        return {row['steam_id']: row['discord_id'] for row in rows}
 
     async def insert_user(self, data: dict) -> None:
         """"""
@@ -159,7 +222,7 @@ class DBManager:
         vals = ", ".join(str(val) for val in data.values())
         sql = f"INSERT INTO users ({cols})\n" \
             f"    VALUES({vals})"
-        await self.query(sql)
+        await self.execute(sql)
 
     async def update_user(self, user_id: int, data: dict) -> None:
         """"""
@@ -168,37 +231,48 @@ class DBManager:
         sql = 'UPDATE users\n' \
             f'    SET {col_vals}\n' \
             f'    WHERE discord_id = $1;'
-        await self.query(sql, user_id)
+        await self.execute(sql, user_id)
 
     async def delete_user(self, user_id: int) -> None:
         """"""
         sql = "DELETE FROM users WHERE discord_id = $1"
-        await self.query(sql, user_id)
+        await self.execute(sql, user_id)
 
     async def get_lobby_by_id(self, lobby_id: int, bot) -> Union["LobbyModel", None]:
         """"""
         sql = "SELECT * FROM lobbies WHERE id = $1;"
-        data = await self.query(sql, lobby_id)
+        data = await self.fetchrow(sql, lobby_id)
         if data:
-            guild = bot.get_guild(data[0]['guild'])
+            guild = bot.get_guild(data['guild'])
             if guild:
-                return LobbyModel.from_dict(data[0], guild)
+                return LobbyModel.from_dict(data, guild)
 
     async def get_lobby_by_voice_channel(self, channel: discord.VoiceChannel) -> Union["LobbyModel", None]:
         """"""
         sql = "SELECT * FROM lobbies\n" \
             f"    WHERE lobby_channel = $1;"
-        data = await self.query(sql, channel.id)
+        data = await self.fetchrow(sql, channel.id)
         if data:
-            return LobbyModel.from_dict(data[0], channel.guild)
+            return LobbyModel.from_dict(data, channel.guild)
 
     async def get_lobby_by_text_channel(self, channel: discord.TextChannel) -> Union["LobbyModel", None]:
         """"""
         sql = "SELECT * FROM lobbies\n" \
             f"    WHERE queue_channel = $1;"
-        data = await self.query(sql, channel.id)
+        data = await self.fetchrow(sql, channel.id)
         if data:
-            return LobbyModel.from_dict(data[0], channel.guild)
+            return LobbyModel.from_dict(data, channel.guild)
+
+    async def get_lobbies(self, bot) -> List["LobbyModel"]:
+        """ Get the lobbies of every guild the bot is in. """
+        sql = "SELECT * FROM lobbies;"
+        lobbies = await self.query(sql)
+        lobby_models = []
+        for data in lobbies:
+            guild = bot.get_guild(data['guild'])
+            if guild:
+                lobby_models.append(LobbyModel.from_dict(data, guild))
+        return lobby_models
 
     async def get_guild_lobbies(self, guild: discord.Guild) -> List["LobbyModel"]:
         """"""
@@ -213,9 +287,9 @@ class DBManager:
             "JOIN lobbies l\n" \
             "    ON qu.lobby_id = l.id AND l.guild = $1\n" \
             "WHERE qu.user_id = $2;"
-        data = await self.query(sql, guild.id, user_id)
+        data = await self.fetchrow(sql, guild.id, user_id)
         if data:
-            return LobbyModel.from_dict(data[0], guild)
+            return LobbyModel.from_dict(data, guild)
 
     async def insert_lobby(self, data: dict) -> int:
         """"""
@@ -226,8 +300,8 @@ class DBManager:
             f"    VALUES({vals})\n" \
             "RETURNING id;"
 
-        lobby = await self.query(sql)
-        return list(map(lambda r: r['id'], lobby))[0]
+        lobby = await self.fetchrow(sql)
+        return lobby['id']
 
     async def update_lobby_data(self, lobby_id: int, data: dict) -> None:
         """"""
@@ -236,12 +310,12 @@ class DBManager:
         sql = "UPDATE lobbies\n" \
             f"    SET {col_vals}\n" \
             f"    WHERE id = $1;"
-        await self.query(sql, lobby_id)
+        await self.execute(sql, lobby_id)
 
     async def delete_lobby(self, lobby_id: int) -> None:
         """"""
         sql = f"DELETE FROM lobbies WHERE id = $1;"
-        await self.query(sql, lobby_id)
+        await self.execute(sql, lobby_id)
 
     async def get_lobby_users(self, lobby_id: int, guild) -> List[discord.Member]:
         """"""
@@ -256,23 +330,49 @@ class DBManager:
                 queued_users.append(user)
         return queued_users
 
+    async def get_all_lobby_users(self) -> Dict[int, List[int]]:
+        """ Get the queued user IDs of every lobby, keyed by lobby ID. """
+        sql = "SELECT lobby_id, user_id FROM queued_users;"
+        query = await self.query(sql)
+        queued_users = defaultdict(list)
+        for row in query:
+            queued_users[row['lobby_id']].append(row['user_id'])
+        return queued_users
+
     async def insert_lobby_user(self, lobby_id: int, user: discord.Member) -> None:
         """"""
         sql = "INSERT INTO queued_users (lobby_id, user_id)\n" \
             f"    VALUES($1, $2);"
-        await self.query(sql, lobby_id, user.id)
+        await self.execute(sql, lobby_id, user.id)
+
+    async def insert_lobby_users(self, lobby_id: int, users: List[discord.Member]) -> None:
+        """ Queue users without the admission check of `queue_lobby_user`. """
+        await self.insert_many(
+            'queued_users', ('lobby_id', 'user_id'), ('INTEGER', 'BIGINT'),
+            [(lobby_id, user.id) for user in users]
+        )
+
+    async def queue_lobby_user(self, lobby_id: int, user_id: int) -> str:
+        """ Atomically check that a user may join a lobby and queue them.
+
+        Returns 'ok' when the user was queued, otherwise the reason code:
+        'not_linked', 'in_match', 'in_lobby', 'full' or 'no_lobby'.
+        """
+        sql = "SELECT queue_lobby_user($1, $2) AS status;"
+        data = await self.fetchrow(sql, lobby_id, user_id)
+        return data['status']
 
     async def delete_lobby_users(self, lobby_id: int, users: List[discord.Member]) -> List[dict]:
         """"""
         sql = "DELETE FROM queued_users\n" \
-            f"    WHERE lobby_id = $1 AND user_id::BIGINT = ANY(ARRAY{[u.id for u in users]}::BIGINT[])\n" \
+            "    WHERE lobby_id = $1 AND user_id = ANY($2::BIGINT[])\n" \
             "    RETURNING user_id;"
-        return await self.query(sql, lobby_id)
+        return await self.query(sql, lobby_id, [u.id for u in users])
 
     async def clear_lobby_users(self, lobby_id: int) -> None:
         """"""
         sql = f"DELETE FROM queued_users WHERE lobby_id = $1;"
-        await self.query(sql, lobby_id)
+        await self.execute(sql, lobby_id)
 
     async def get_lobby_maps(self, lobby_id: int) -> List[str]:
         """"""
@@ -283,18 +383,19 @@ class DBManager:
     async def clear_lobby_maps(self, lobby_id: int) -> None:
         """"""
         sql = "DELETE FROM lobby_maps WHERE lobby_id = $1;"
-        await self.query(sql, lobby_id)
+        await self.execute(sql, lobby_id)
 
     async def insert_lobby_maps(self, lobby_id: int, maps: List[str]) -> None:
         """"""
-        values = f", ".join(f"({lobby_id}, '{m}')" for m in maps)
-        sql = f"INSERT INTO lobby_maps (lobby_id, map_name) VALUES {values};"
-        await self.query(sql)
+        await self.insert_many(
+            'lobby_maps', ('lobby_id', 'map_name'), ('INTEGER', 'VARCHAR'),
+            [(lobby_id, m) for m in maps]
+        )
 
     async def delete_lobby_maps(self, lobby_id: int, maps: List[str]) -> None:
         """"""
         sql = "DELETE FROM lobby_maps WHERE lobby_id = $1 AND map_name = ANY($2);"
-        await self.query(sql, lobby_id, maps)
+        await self.execute(sql, lobby_id, maps)
 
     async def update_lobby_maps(self, lobby_id: int, new_maps: List[str], existing_maps: List[str]) -> None:
         """"""
@@ -311,10 +412,47 @@ class DBManager:
         """"""
         sql = "SELECT * FROM guilds\n" \
             f"    WHERE id =  $1;"
-        data = await self.query(sql, guild_id)
+        data = await self.fetchrow(sql, guild_id)
         if data:
             guild = bot.get_guild(guild_id)
-            return GuildModel.from_dict(data[0], guild)
+            return GuildModel.from_dict(data, guild)
+
+    async def get_guilds(self, guilds: List[discord.Guild]) -> Dict[int, "GuildModel"]:
+        """ Get the models of several guilds in one query, keyed by guild ID. """
+        guilds_by_id = {guild.id: guild for guild in guilds}
+        sql = "SELECT * FROM guilds WHERE id = ANY($1::BIGINT[]);"
+        guilds_data = await self.query(sql, list(guilds_by_id))
+        return {
+            data['id']: GuildModel.from_dict(data, guilds_by_id[data['id']])
+            for data in guilds_data
+        }
+
+    async def count_pooled_channels(self, guild_id: int) -> int:
+        """"""
+        sql = "SELECT COUNT(*) AS count FROM channel_pool WHERE guild = $1;"
+        data = await self.fetchrow(sql, guild_id)
+        return data['count']
+
+    async def pop_pooled_channels(self, guild_id: int) -> Optional[dict]:
+        """ Take the channels of the guild that were released the longest ago out of the pool. """
+        sql = "DELETE FROM channel_pool WHERE category = (\n" \
+            "    SELECT category FROM channel_pool WHERE guild = $1\n" \
+            "    ORDER BY released_at LIMIT 1 FOR UPDATE SKIP LOCKED\n" \
+            ") RETURNING *;"
+        return await self.fetchrow(sql, guild_id)
+
+    async def insert_pooled_channels(
+        self,
+        guild_id: int,
+        category_id: int,
+        team1_channel_id: int,
+        team2_channel_id: int
+    ) -> None:
+        """"""
+        sql = "INSERT INTO channel_pool (guild, category, team1_channel, team2_channel)\n" \
+            "    VALUES ($1, $2, $3, $4)\n" \
+            "    ON CONFLICT (category) DO NOTHING;"
+        await self.execute(sql, guild_id, category_id, team1_channel_id, team2_channel_id)
 
     async def update_guild_data(self, guild_id: int, data: dict) -> None:
         """"""
@@ -323,25 +461,25 @@ class DBManager:
         sql = 'UPDATE guilds\n' \
             f'    SET {col_vals}\n' \
             f'    WHERE id = $1;'
-        await self.query(sql, guild_id)
+        await self.execute(sql, guild_id)
 
     async def get_team_by_id(self, team_id: int, bot) -> Union["TeamModel", None]:
         """"""
         sql = "SELECT * FROM teams WHERE id = $1;"
-        data = await self.query(sql, team_id)
+        data = await self.fetchrow(sql, team_id)
         if data:
-            guild = bot.get_guild(data[0]['guild'])
+            guild = bot.get_guild(data['guild'])
             if guild:
-                return TeamModel.from_dict(data[0], guild)
+                return TeamModel.from_dict(data, guild)
             
     async def get_team_by_role(self, role: discord.Role, bot) -> Union["TeamModel", None]:
         """"""
         sql = "SELECT * FROM teams WHERE role = $1;"
-        data = await self.query(sql, role.id)
+        data = await self.fetchrow(sql, role.id)
         if data:
-            guild = bot.get_guild(data[0]['guild'])
+            guild = bot.get_guild(data['guild'])
             if guild:
-                return TeamModel.from_dict(data[0], guild)
+                return TeamModel.from_dict(data, guild)
             
     async def get_guild_teams(self, guild: discord.Guild):
         """"""
@@ -355,7 +493,7 @@ class DBManager:
         vals = ", ".join(str(val) for val in data.values())
         sql = f"INSERT INTO teams ({cols})\n" \
             f"    VALUES({vals});"
-        await self.query(sql)
+        await self.execute(sql)
 
     async def update_team(self, team_id: int, **kwargs) -> None:
         """"""
@@ -364,17 +502,17 @@ class DBManager:
 
     async def insert_team_users(self, team_id: int, users: List[discord.Member]) -> None:
         """"""
-        values = f", ".join(
-            f"({team_id}, {user.id})" for user in users)
-        sql = f"INSERT INTO team_users VALUES {values};"
-        await self.query(sql)
+        await self.insert_many(
+            'team_users', ('team_id', 'user_id'), ('INTEGER', 'BIGINT'),
+            [(team_id, user.id) for user in users]
+        )
 
     async def delete_team_users(self, team_id: int, users: List[discord.Member]) -> List[dict]:
         """"""
         sql = "DELETE FROM team_users\n" \
-            f"    WHERE team_id = $1 AND user_id::BIGINT = ANY(ARRAY{[u.id for u in users]}::BIGINT[])\n" \
+            "    WHERE team_id = $1 AND user_id = ANY($2::BIGINT[])\n" \
             "    RETURNING user_id;"
-        return await self.query(sql, team_id)
+        return await self.query(sql, team_id, [u.id for u in users])
     
     async def get_user_team(self, user_id: int, guild: discord.Guild) -> Optional[TeamModel]:
         """"""
@@ -382,9 +520,9 @@ class DBManager:
             "JOIN team_users tu\n" \
             "    ON tu.team_id = t.id AND t.guild = $1\n" \
             "WHERE tu.user_id = $2;"
-        data = await self.query(sql, guild.id, user_id)
+        data = await self.fetchrow(sql, guild.id, user_id)
         if data:
-            return TeamModel.from_dict(data[0], guild)
+            return TeamModel.from_dict(data, guild)
         
     async def get_team_users(self, team_id: int, guild: discord.Guild) -> List[discord.Member]:
         """"""
@@ -404,14 +542,14 @@ class DBManager:
     async def delete_team(self, team_id: int, guild: discord.Guild):
         """"""
         sql = "DELETE FROM teams WHERE id = $1 AND guild = $2;"
-        await self.query(sql, team_id, guild.id)
+        await self.execute(sql, team_id, guild.id)
 
     async def get_team_match(self, team_id: int, guild: discord.Guild):
         """"""
         sql = "SELECT * FROM matches WHERE team1_id = $1 OR team2_id = $1 AND guild = $2;"
-        data = await self.query(sql, team_id, guild.id)
+        data = await self.fetchrow(sql, team_id, guild.id)
         if data:
-            return MatchModel.from_dict(data[0], guild)
+            return MatchModel.from_dict(data, guild)
         
     async def get_spectators(self, guild: discord.Guild) -> List[UserModel]:
         """"""
@@ -424,15 +562,15 @@ class DBManager:
     
     async def insert_spectators(self, *users: List[discord.Member], guild: discord.Guild):
         """"""
-        values = f", ".join(
-            f"({guild.id}, {user.id})" for user in users)
-        sql = f"INSERT INTO spectators VALUES {values};"
-        await self.query(sql)
+        await self.insert_many(
+            'spectators', ('guild_id', 'user_id'), ('BIGINT', 'BIGINT'),
+            [(guild.id, user.id) for user in users]
+        )
         
     async def delete_spectators(self, *users: List[discord.Member], guild: discord.Guild):
         """"""
         sql = "DELETE FROM spectators\n" \
-             f"    WHERE user_id::BIGINT = ANY(ARRAY{[u.id for u in users]}::BIGINT[]) AND guild_id = $1\n" \
-              "RETURNING user_id;"
-        return await self.query(sql, guild.id)
+            "    WHERE user_id = ANY($2::BIGINT[]) AND guild_id = $1\n" \
+            "RETURNING user_id;"
+        return await self.query(sql, guild.id, [u.id for u in users])
 db = DBManager()
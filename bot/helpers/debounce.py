@@ -0,0 +1,79 @@
+# bot/helpers/debounce.py
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class KeyedLock:
+    """ One lock per key, dropped once nobody holds or waits for it. """
+
+    def __init__(self):
+        """"""
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._users: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        """ Hold the lock of a key. """
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+
+class Debouncer:
+    """ Coalesces bursts of calls per key into a single delayed callback.
+
+    The callback receives the key and the payload of the latest call made
+    during the window. Callbacks for the same key never run concurrently.
+    """
+
+    def __init__(self, delay: float, callback: Callable[[Hashable, Any], Awaitable[None]]):
+        """"""
+        self.delay = delay
+        self.callback = callback
+        self.logger = logging.getLogger('Bot')
+        self._payloads: Dict[Hashable, Any] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._locks = KeyedLock()
+
+    def schedule(self, key: Hashable, payload: Any=None) -> None:
+        """ Request a callback for the key, replacing any pending payload. """
+        self._payloads[key] = payload
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def cancel(self, key: Hashable) -> None:
+        """ Drop the pending callback for the key and wait for a running one to finish. """
+        task = self._tasks.pop(key, None)
+        if task:
+            task.cancel()
+        self._payloads.pop(key, None)
+        async with self._locks.hold(key):
+            pass
+
+    async def _run(self, key: Hashable) -> None:
+        """"""
+        await asyncio.sleep(self.delay)
+        self._tasks.pop(key, None)
+        async with self._locks.hold(key):
+            if key not in self._payloads:
+                return
+            payload = self._payloads.pop(key)
+            try:
+                await self.callback(key, payload)
+            except Exception as e:
+                self.logger.error(f"Debounced callback failed for {key}: {e}", exc_info=1)
@@ -0,0 +1,194 @@
+# bot/helpers/dispatcher.py
+
+import asyncio
+import heapq
+import itertools
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+# Lower runs first.
+PRIORITY_MATCH_MOVE = 0    # Moving players into their match channels
+PRIORITY_CHANNEL = 10      # Creating, editing and deleting channels
+PRIORITY_MOVE = 20         # Moving players back to pre-match
+PRIORITY_EMBED = 30        # Refreshing lobby and match embeds
+PRIORITY_BACKGROUND = 40   # Filling the channel pool
+
+
+class Action:
+    """ A Discord REST call waiting in the dispatcher queue. """
+
+    __slots__ = ('priority', 'seq', 'route', 'guild_id', 'key', 'factory', 'future', 'queued_at')
+
+    def __init__(
+        self,
+        priority: int,
+        seq: int,
+        route: str,
+        guild_id: int,
+        key: Optional[Hashable],
+        factory: Callable[[], Awaitable[Any]],
+        future: asyncio.Future
+    ):
+        """"""
+        self.priority = priority
+        self.seq = seq
+        self.route = route
+        self.guild_id = guild_id
+        self.key = key
+        self.factory = factory
+        self.future = future
+        self.queued_at = asyncio.get_event_loop().time()
+
+    def __lt__(self, other: "Action") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ActionDispatcher:
+    """ Central queue for the bot's Discord REST calls.
+
+    Actions run by priority, then in submission order, with a concurrency
+    cap per route and per guild so bursts stay within discord.py's rate
+    limit buckets instead of piling up on them. An action submitted with
+    the `key` of a queued one replaces it, so superseded edits of the same
+    message are sent once. `submit` returns a future of the call's result.
+    """
+
+    def __init__(self, route_limits: Dict[str, int], default_route_limit: int, guild_limit: int):
+        """"""
+        self.route_limits = route_limits
+        self.default_route_limit = default_route_limit
+        self.guild_limit = guild_limit
+        self.counters = Counter()
+        self._queue: List[Action] = []
+        self._keyed: Dict[Hashable, Action] = {}
+        self._route_running = Counter()
+        self._guild_running = Counter()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+
+    def start(self) -> None:
+        """"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """ Stop dispatching and cancel the queued and running actions. """
+        for action in self._queue:
+            action.future.cancel()
+        self._queue.clear()
+        self._keyed.clear()
+        tasks = [task for task in [self._task, *self._running] if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(
+        self,
+        route: str,
+        guild_id: int,
+        factory: Callable[[], Awaitable[Any]],
+        priority: int=PRIORITY_EMBED,
+        key: Hashable=None
+    ) -> asyncio.Future:
+        """ Queue a call, `factory` creates its coroutine once it is its turn. """
+        self.counters['submitted'] += 1
+        if key is not None and key in self._keyed:
+            action = self._keyed[key]
+            action.factory = factory
+            action.priority = min(action.priority, priority)
+            heapq.heapify(self._queue)
+            self.counters['merged'] += 1
+            return action.future
+
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(self._consume)
+        action = Action(priority, next(self._seq), route, guild_id, key, factory, future)
+        heapq.heappush(self._queue, action)
+        if key is not None:
+            self._keyed[key] = action
+        self._wakeup.set()
+        return future
+
+    def metrics(self) -> Dict[str, Any]:
+        """ Queue depth per route, running actions per route and lifetime counters. """
+        now = asyncio.get_event_loop().time()
+        return {
+            'queued': len(self._queue),
+            'queued_by_route': dict(Counter(action.route for action in self._queue)),
+            'running_by_route': {k: v for k, v in self._route_running.items() if v},
+            'oldest_wait': max((now - a.queued_at for a in self._queue), default=0.0),
+            **self.counters
+        }
+
+    @staticmethod
+    def _consume(future: asyncio.Future) -> None:
+        """ Mark the error of fire-and-forget actions as retrieved. """
+        if not future.cancelled():
+            future.exception()
+
+    def _can_run(self, action: Action) -> bool:
+        """"""
+        route_limit = self.route_limits.get(action.route, self.default_route_limit)
+        return self._route_running[action.route] < route_limit \
+            and self._guild_running[action.guild_id] < self.guild_limit
+
+    def _next(self) -> Optional[Action]:
+        """ Pop the first action by priority whose route and guild have a free slot. """
+        blocked = []
+        found = None
+        while self._queue:
+            action = heapq.heappop(self._queue)
+            if action.future.cancelled():
+                self._forget(action)
+                continue
+            if self._can_run(action):
+                found = action
+                break
+            blocked.append(action)
+        for action in blocked:
+            heapq.heappush(self._queue, action)
+        return found
+
+    def _forget(self, action: Action) -> None:
+        """"""
+        if action.key is not None and self._keyed.get(action.key) is action:
+            del self._keyed[action.key]
+
+    async def _run(self) -> None:
+        """"""
+        while True:
+            self._wakeup.clear()
+            action = self._next()
+            if action is None:
+                await self._wakeup.wait()
+                continue
+            # Later submissions with the same key are new actions from now on.
+            self._forget(action)
+            self._route_running[action.route] += 1
+            self._guild_running[action.guild_id] += 1
+            task = asyncio.create_task(self._execute(action))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, action: Action) -> None:
+        """"""
+        try:
+            result = await action.factory()
+        except asyncio.CancelledError:
+            action.future.cancel()
+            raise
+        except Exception as e:
+            self.counters['failed'] += 1
+            if not action.future.done():
+                action.future.set_exception(e)
+        else:
+            self.counters['completed'] += 1
+            if not action.future.done():
+                action.future.set_result(result)
+        finally:
+            self._route_running[action.route] -= 1
+            self._guild_running[action.guild_id] -= 1
+            self._wakeup.set()
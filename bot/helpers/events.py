@@ -0,0 +1,85 @@
+# bot/helpers/events.py
+
+import hmac
+import logging
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from bot.helpers.configs import Config
+
+
+# Get5 events that change what the match embed shows or end the match.
+MATCH_EVENTS = {
+    'series_start',
+    'going_live',
+    'round_end',
+    'map_result',
+    'series_end',
+    'series_cancel',
+}
+
+
+class EventReceiver:
+    """ Local HTTP endpoint receiving Get5 match events.
+
+    G5API keeps `get5_remote_log_url` for its own stats, so events reach this
+    endpoint through a forwarder (or a second log target) that POSTs the Get5
+    JSON body to `/events` with the shared secret in the `Authorization`
+    header. `handler` is called with the match id and event name of every
+    accepted event.
+    """
+
+    def __init__(self, handler: Callable[[int, str], Awaitable[None]]):
+        """"""
+        self.handler = handler
+        self.logger = logging.getLogger('Bot')
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> bool:
+        """ Start listening on the configured host and port. Returns whether it is listening. """
+        if not Config.events_secret:
+            self.logger.warning("Event receiver not started: events.secret is not set")
+            return False
+        app = web.Application()
+        app.router.add_post('/events', self.receive)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, Config.events_host, Config.events_port)
+        try:
+            await site.start()
+        except OSError as e:
+            self.logger.error(
+                f"Event receiver not started: can't listen on {Config.events_host}:{Config.events_port}: {e}")
+            await self.close()
+            return False
+        self.logger.info(f"Listening for match events on {Config.events_host}:{Config.events_port}")
+        return True
+
+    async def close(self) -> None:
+        """"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def receive(self, request: web.Request) -> web.Response:
+        """"""
+        secret = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(secret.encode(), Config.events_secret.encode()):
+            return web.Response(status=401)
+
+        try:
+            data = await request.json()
+            event = data['event']
+            match_id = int(data['matchid'])
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+
+        if event in MATCH_EVENTS:
+            try:
+                await self.handler(match_id, event)
+            except Exception as e:
+                self.logger.error(f"Failed to handle {event} of match #{match_id}: {e}", exc_info=1)
+                return web.Response(status=500)
+
+        return web.Response(status=200)
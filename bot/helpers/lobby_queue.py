@@ -0,0 +1,115 @@
+# bot/helpers/lobby_queue.py
+
+import asyncio
+import logging
+from typing import Coroutine, List, Optional
+
+import discord
+
+from bot.helpers.db import db
+
+
+class LobbyQueue:
+    """ Authoritative in-memory state of the users queued in a lobby.
+
+    Changes are applied in memory right away and written through to the
+    `queued_users` table in the background, in the order they were made.
+    If a write fails, the queue is reloaded from the table once the writes
+    queued after it are done.
+    """
+
+    def __init__(self, lobby_id: int, guild: discord.Guild, user_ids: List[int]=None):
+        """"""
+        self.lobby_id = lobby_id
+        self.guild = guild
+        self.user_ids = list(user_ids or [])
+        self.logger = logging.getLogger('DB')
+        self._last_write: Optional[asyncio.Task] = None
+        self._stale = False
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def __contains__(self, user: discord.Member) -> bool:
+        return user.id in self.user_ids
+
+    @property
+    def users(self) -> List[discord.Member]:
+        """ Queued users that are still members of the guild, in queue order. """
+        members = (self.guild.get_member(uid) for uid in self.user_ids)
+        return [member for member in members if member]
+
+    async def admit(self, user: discord.Member) -> str:
+        """ Queue a user if the database admission check allows it.
+
+        Pending writes are flushed first so the check sees the current queue.
+        Returns the reason code of `DBManager.queue_lobby_user`.
+        """
+        await self.flush()
+        status = await db.queue_lobby_user(self.lobby_id, user.id)
+        if status == 'ok':
+            self.user_ids.append(user.id)
+        return status
+
+    def prepend(self, users: List[discord.Member]) -> List[discord.Member]:
+        """ Put users back at the front of the queue and return the ones that were added.
+
+        Used for users who already held a place, so there is no admission check.
+        """
+        added = [u for u in users if u.id not in self.user_ids]
+        if added:
+            self.user_ids = [u.id for u in added] + self.user_ids
+            self._write(db.insert_lobby_users(self.lobby_id, added))
+        return added
+
+    def remove(self, users: List[discord.Member]) -> List[discord.Member]:
+        """ Remove users from the queue and return the ones that were queued. """
+        removed = [u for u in users if u.id in self.user_ids]
+        if removed:
+            removed_ids = {u.id for u in removed}
+            self.user_ids = [uid for uid in self.user_ids if uid not in removed_ids]
+            self._write(db.delete_lobby_users(self.lobby_id, removed))
+        return removed
+
+    def clear(self) -> None:
+        """ Remove every user from the queue. """
+        self.user_ids = []
+        self._write(db.clear_lobby_users(self.lobby_id))
+
+    async def flush(self) -> None:
+        """ Wait until every pending change has been written to the database. """
+        if self._last_write:
+            await asyncio.wait([self._last_write])
+
+    def _write(self, coro: Coroutine) -> None:
+        """ Schedule a database write to run after the previous one. """
+        previous = self._last_write
+
+        async def write():
+            if previous:
+                await asyncio.wait([previous])
+            try:
+                await coro
+            except Exception as e:
+                self.logger.error(
+                    f"Failed to persist queue of lobby #{self.lobby_id}, reloading it: {e}", exc_info=1)
+                self._stale = True
+            if self._stale and self._last_write is task:
+                await self._reload(task)
+
+        task = asyncio.create_task(write())
+        self._last_write = task
+
+    async def _reload(self, task: asyncio.Task) -> None:
+        """ Replace the in-memory queue with the database's after a failed write. """
+        try:
+            db_ids = [user.id for user in await db.get_lobby_users(self.lobby_id, self.guild)]
+        except Exception as e:
+            self.logger.error(f"Failed to reload queue of lobby #{self.lobby_id}: {e}", exc_info=1)
+            return
+
+        # Changes made meanwhile have their own write, the queue is reloaded after it instead.
+        if self._last_write is task:
+            kept = [uid for uid in self.user_ids if uid in db_ids]
+            self.user_ids = kept + [uid for uid in db_ids if uid not in kept]
+            self._stale = False
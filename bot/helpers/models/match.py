@@ -17,7 +17,8 @@ class MatchModel:
         team1_channel: Optional[discord.VoiceChannel],
         team2_channel: Optional[discord.VoiceChannel],
         team1_id: int,
-        team2_id: int
+        team2_id: int,
+        finished: bool=False
     ):
         """"""
         self.id = match_id
@@ -29,6 +30,7 @@ class MatchModel:
         self.team2_channel = team2_channel
         self.team1_id = team1_id
         self.team2_id = team2_id
+        self.finished = finished
 
     @classmethod
     def from_dict(cls, data: dict, guild: discord.Guild) -> "MatchModel":
@@ -42,5 +44,6 @@ class MatchModel:
             guild.get_channel(data['team1_channel']),
             guild.get_channel(data['team2_channel']),
             data['team1_id'],
-            data['team2_id']
+            data['team2_id'],
+            data.get('finished', False)
         )
\ No newline at end of file
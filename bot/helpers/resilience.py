@@ -0,0 +1,98 @@
+# bot/helpers/resilience.py
+
+import logging
+import random
+import time
+from typing import Optional
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """ Exponential backoff with full jitter for the given retry attempt (0-based). """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """ Fails fast while an endpoint keeps failing.
+
+    The breaker opens after `threshold` consecutive failures. Once
+    `reset_timeout` seconds have passed it lets a single probe request
+    through (half-open): a success closes it again, a failure re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, threshold: int, reset_timeout: float):
+        """"""
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.logger = logging.getLogger('API')
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        """"""
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def is_open(self) -> bool:
+        """ Whether requests are currently refused. """
+        return self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing)
+
+    def allow(self) -> Optional[str]:
+        """ Whether a request may be sent now.
+
+        Returns the state the request was let through in, to pass back to
+        `release` and `record_*`, or None if it is refused. Claims the probe
+        slot when half-open.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return self.CLOSED
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return self.HALF_OPEN
+        return None
+
+    def release(self, admitted: str) -> None:
+        """ End a request that has no result, e.g. cancelled, giving back the probe slot it claimed. """
+        if admitted == self.HALF_OPEN:
+            self._probing = False
+
+    def record_success(self, admitted: str) -> None:
+        """"""
+        if self._is_stale(admitted):
+            return
+        if self.opened_at is not None:
+            self.logger.info(f"Circuit for {self.name} closed")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self, admitted: str) -> None:
+        """"""
+        if self._is_stale(admitted):
+            return
+        probing = admitted == self.HALF_OPEN
+        self.failures += 1
+        if probing or self.failures >= self.threshold:
+            if self.opened_at is None or probing:
+                self.logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        if probing:
+            self._probing = False
+
+    def _is_stale(self, admitted: str) -> bool:
+        """ Whether a request let through while closed ended after the circuit opened.
+
+        Only the probe decides the state of an open circuit.
+        """
+        return admitted == self.CLOSED and self.opened_at is not None
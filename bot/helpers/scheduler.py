@@ -0,0 +1,120 @@
+# bot/helpers/scheduler.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+
+class PollScheduler:
+    """ Polls keys at their own interval, earliest due first.
+
+    Pending polls sit in a heap keyed by their due time. The callback
+    returns the delay until the next poll of its key, or `None` to stop
+    polling it. Delays are jittered so keys scheduled together spread out,
+    and at most `concurrency` callbacks run at once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        callback: Callable[[Hashable], Awaitable[Optional[float]]],
+        concurrency: int,
+        jitter: float=0.1,
+        retry_delay: float=30.0
+    ):
+        """"""
+        self.name = name
+        self.callback = callback
+        self.jitter = jitter
+        self.retry_delay = retry_delay
+        self.logger = logging.getLogger('Bot')
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._due: Dict[Hashable, float] = {}
+        self._running: Set[Hashable] = set()
+        self._polls: Set[asyncio.Task] = set()
+        self._seq = itertools.count()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._due or key in self._running
+
+    def start(self) -> None:
+        """"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """ Stop polling and cancel the running polls. """
+        tasks = [task for task in [self._task, *self._polls] if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def schedule(self, key: Hashable, delay: float=0.0) -> None:
+        """ Poll a key after `delay` seconds, replacing its pending poll. """
+        if delay:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        due = asyncio.get_event_loop().time() + delay
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._seq), key))
+        self._wakeup.set()
+
+    def unschedule(self, key: Hashable) -> None:
+        """ Drop the pending poll of a key. """
+        self._due.pop(key, None)
+
+    async def _run(self) -> None:
+        """"""
+        loop = asyncio.get_event_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            due, _, key = self._heap[0]
+            if self._due.get(key) != due:
+                # Rescheduled or unscheduled since it was pushed.
+                heapq.heappop(self._heap)
+                continue
+
+            delay = due - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if key in self._running:
+                # Keep it due, it is pushed back once the running poll is done.
+                continue
+            del self._due[key]
+            await self._semaphore.acquire()
+            self._running.add(key)
+            task = asyncio.create_task(self._poll(key))
+            self._polls.add(task)
+            task.add_done_callback(self._polls.discard)
+
+    async def _poll(self, key: Hashable) -> None:
+        """"""
+        delay = None
+        try:
+            delay = await self.callback(key)
+        except Exception as e:
+            self.logger.error(f"{self.name} poll of {key} failed: {e}", exc_info=1)
+            delay = self.retry_delay
+        finally:
+            self._running.discard(key)
+            self._semaphore.release()
+            if key in self._due:
+                heapq.heappush(self._heap, (self._due[key], next(self._seq), key))
+                self._wakeup.set()
+            elif delay is not None:
+                self.schedule(key, delay)
@@ -0,0 +1,116 @@
+# bot/helpers/workers.py
+
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class Job:
+    """ State of a job submitted to a WorkerPool. """
+
+    def __init__(self, job_id: int, name: str):
+        """"""
+        self.id = job_id
+        self.name = name
+        self.state = 'queued'  # queued, running, done, failed, cancelled
+        self.stage = None  # Free-form progress marker set by the job itself.
+        self.error: Optional[BaseException] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def __repr__(self) -> str:
+        return f"<Job #{self.id} {self.name} state={self.state} stage={self.stage}>"
+
+
+class WorkerPool:
+    """ Runs background jobs with a bounded concurrency and tracks their state.
+
+    Jobs that raise are logged and marked as failed without affecting the
+    other jobs of the pool. Finished jobs are kept in a history of at most
+    `history_size` jobs for `history_ttl` seconds, so their outcome can
+    still be looked up with `get`.
+    """
+
+    def __init__(self, name: str, concurrency: int, history_size: int=100, history_ttl: float=3600.0):
+        """"""
+        self.name = name
+        self.concurrency = concurrency
+        self.history_size = history_size
+        self.history_ttl = history_ttl
+        self.logger = logging.getLogger('Bot')
+        self.jobs: Dict[int, Job] = {}
+        self._history: Dict[int, Job] = OrderedDict()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._ids = itertools.count(1)
+
+    @property
+    def running(self) -> List[Job]:
+        """ Jobs currently holding a worker slot. """
+        return [job for job in self.jobs.values() if job.state == 'running']
+
+    @property
+    def queued(self) -> List[Job]:
+        """ Jobs waiting for a free worker slot. """
+        return [job for job in self.jobs.values() if job.state == 'queued']
+
+    @property
+    def finished(self) -> List[Job]:
+        """ Recently finished jobs, oldest first. """
+        self._prune()
+        return list(self._history.values())
+
+    def get(self, job_id: int) -> Optional[Job]:
+        """ A queued or running job, or a finished one still in the history. """
+        self._prune()
+        return self.jobs.get(job_id) or self._history.get(job_id)
+
+    def submit(self, name: str, factory: Callable[[Job], Awaitable[None]]) -> Job:
+        """ Queue a job. `factory` is called with the job once a worker is free. """
+        job = Job(next(self._ids), name)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, factory))
+        return job
+
+    async def close(self) -> None:
+        """ Cancel every pending and running job. """
+        tasks = [job.task for job in self.jobs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: Job, factory: Callable[[Job], Awaitable[None]]) -> None:
+        """"""
+        try:
+            async with self._semaphore:
+                job.state = 'running'
+                job.started_at = datetime.utcnow()
+                await factory(job)
+        except asyncio.CancelledError:
+            job.state = 'cancelled'
+            raise
+        except Exception as e:
+            job.state = 'failed'
+            job.error = e
+            self.logger.error(f"{self.name} worker pool: {job!r} failed: {e}", exc_info=e)
+        else:
+            job.state = 'done'
+        finally:
+            job.finished_at = datetime.utcnow()
+            self.jobs.pop(job.id, None)
+            self._history[job.id] = job
+            self._prune()
+
+    def _prune(self) -> None:
+        """ Drop finished jobs past the history size or age. """
+        now = datetime.utcnow()
+        while self._history:
+            oldest = next(iter(self._history.values()))
+            if len(self._history) <= self.history_size \
+                    and (now - oldest.finished_at).total_seconds() < self.history_ttl:
+                break
+            self._history.popitem(last=False)
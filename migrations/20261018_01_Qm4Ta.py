@@ -0,0 +1,51 @@
+"""
+Add queue_lobby_user function
+"""
+
+from yoyo import step
+
+__depends__ = {'20230809_01_2Jj60'}
+
+steps = [
+    step(
+        (
+            'CREATE FUNCTION queue_lobby_user(p_lobby_id INTEGER, p_user_id BIGINT)\n'
+            'RETURNS TEXT AS $$\n'
+            'DECLARE\n'
+            '    v_guild BIGINT;\n'
+            '    v_capacity SMALLINT;\n'
+            'BEGIN\n'
+            '    -- Lock the lobby so concurrent admissions are checked one at a time.\n'
+            '    SELECT guild, capacity INTO v_guild, v_capacity\n'
+            '        FROM lobbies WHERE id = p_lobby_id FOR UPDATE;\n'
+            '    IF NOT FOUND THEN\n'
+            '        RETURN \'no_lobby\';\n'
+            '    END IF;\n'
+            '    IF NOT EXISTS (\n'
+            '        SELECT 1 FROM users WHERE discord_id = p_user_id AND steam_id IS NOT NULL\n'
+            '    ) THEN\n'
+            '        RETURN \'not_linked\';\n'
+            '    END IF;\n'
+            '    IF EXISTS (\n'
+            '        SELECT 1 FROM match_users mu\n'
+            '        JOIN matches m ON mu.match_id = m.id AND m.guild = v_guild\n'
+            '        WHERE mu.user_id = p_user_id\n'
+            '    ) THEN\n'
+            '        RETURN \'in_match\';\n'
+            '    END IF;\n'
+            '    IF EXISTS (\n'
+            '        SELECT 1 FROM queued_users WHERE lobby_id = p_lobby_id AND user_id = p_user_id\n'
+            '    ) THEN\n'
+            '        RETURN \'in_lobby\';\n'
+            '    END IF;\n'
+            '    IF (SELECT COUNT(*) FROM queued_users WHERE lobby_id = p_lobby_id) >= v_capacity THEN\n'
+            '        RETURN \'full\';\n'
+            '    END IF;\n'
+            '    INSERT INTO queued_users (lobby_id, user_id) VALUES (p_lobby_id, p_user_id);\n'
+            '    RETURN \'ok\';\n'
+            'END;\n'
+            '$$ LANGUAGE plpgsql;'
+        ),
+        'DROP FUNCTION queue_lobby_user(INTEGER, BIGINT);'
+    )
+]
@@ -0,0 +1,22 @@
+"""
+Add match finished flag
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_01_Qm4Ta'}
+
+steps = [
+    step(
+        (
+            'ALTER TABLE matches\n'
+            'ADD COLUMN finished BOOLEAN NOT NULL DEFAULT FALSE\n'
+            ';'
+        ),
+        (
+            'ALTER TABLE matches\n'
+            'DROP COLUMN finished\n'
+            ';'
+        )
+    )
+]
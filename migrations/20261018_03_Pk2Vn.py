@@ -0,0 +1,22 @@
+"""
+Add pool of free match channels
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_02_Hf7Wd'}
+
+steps = [
+    step(
+        (
+            'CREATE TABLE channel_pool(\n'
+            '    category BIGINT PRIMARY KEY,\n'
+            '    guild BIGINT REFERENCES guilds (id) ON DELETE CASCADE,\n'
+            '    team1_channel BIGINT NOT NULL,\n'
+            '    team2_channel BIGINT NOT NULL,\n'
+            '    released_at TIMESTAMP NOT NULL DEFAULT NOW()\n'
+            ');'
+        ),
+        'DROP TABLE channel_pool;'
+    )
+]
@@ -0,0 +1,53 @@
+"""
+Add indexes for hot lookup columns
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_03_Pk2Vn'}
+
+# The user_id indexes also hold the other key column so lookups by user
+# are answered from the index alone. spectators.guild_id is not indexed
+# separately, it already leads the spectators primary key.
+steps = [
+    step(
+        'CREATE INDEX IF NOT EXISTS lobbies_lobby_channel_idx ON lobbies (lobby_channel);',
+        'DROP INDEX IF EXISTS lobbies_lobby_channel_idx;'
+    ),
+    step(
+        'CREATE INDEX IF NOT EXISTS lobbies_queue_channel_idx ON lobbies (queue_channel);',
+        'DROP INDEX IF EXISTS lobbies_queue_channel_idx;'
+    ),
+    step(
+        'CREATE INDEX IF NOT EXISTS lobbies_guild_idx ON lobbies (guild);',
+        'DROP INDEX IF EXISTS lobbies_guild_idx;'
+    ),
+    step(
+        'CREATE INDEX IF NOT EXISTS matches_guild_idx ON matches (guild);',
+        'DROP INDEX IF EXISTS matches_guild_idx;'
+    ),
+    step(
+        'CREATE INDEX IF NOT EXISTS teams_role_idx ON teams (role);',
+        'DROP INDEX IF EXISTS teams_role_idx;'
+    ),
+    step(
+        'CREATE INDEX IF NOT EXISTS teams_guild_idx ON teams (guild);',
+        'DROP INDEX IF EXISTS teams_guild_idx;'
+    ),
+    step(
+        'CREATE INDEX IF NOT EXISTS match_users_user_id_idx ON match_users (user_id, match_id);',
+        'DROP INDEX IF EXISTS match_users_user_id_idx;'
+    ),
+    step(
+        'CREATE INDEX IF NOT EXISTS queued_users_user_id_idx ON queued_users (user_id, lobby_id);',
+        'DROP INDEX IF EXISTS queued_users_user_id_idx;'
+    ),
+    step(
+        'CREATE INDEX IF NOT EXISTS team_users_user_id_idx ON team_users (user_id, team_id);',
+        'DROP INDEX IF EXISTS team_users_user_id_idx;'
+    ),
+    step(
+        'CREATE INDEX IF NOT EXISTS channel_pool_guild_idx ON channel_pool (guild, released_at);',
+        'DROP INDEX IF EXISTS channel_pool_guild_idx;'
+    )
+]
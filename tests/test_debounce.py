@@ -0,0 +1,46 @@
+# tests/test_debounce.py
+
+import asyncio
+import unittest
+
+from bot.helpers.debounce import Debouncer, KeyedLock
+
+
+class KeyedLockTest(unittest.IsolatedAsyncioTestCase):
+    """"""
+
+    async def test_lock_is_dropped_after_last_holder(self):
+        locks = KeyedLock()
+        order = []
+
+        async def hold(name: str):
+            async with locks.hold('key'):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(hold('a'), hold('b'))
+
+        self.assertEqual(order, ['a', 'b'])
+        self.assertEqual(len(locks), 0)
+
+
+class DebouncerTest(unittest.IsolatedAsyncioTestCase):
+    """"""
+
+    async def test_burst_is_coalesced_and_lock_dropped(self):
+        calls = []
+
+        async def callback(key, payload):
+            calls.append((key, payload))
+
+        debouncer = Debouncer(0.01, callback)
+        for payload in range(3):
+            debouncer.schedule('key', payload)
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(calls, [('key', 2)])
+        self.assertEqual(len(debouncer._locks), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
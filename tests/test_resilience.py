@@ -0,0 +1,42 @@
+# tests/test_resilience.py
+
+import unittest
+
+from bot.helpers.resilience import CircuitBreaker
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """"""
+
+    def half_open_breaker(self) -> CircuitBreaker:
+        breaker = CircuitBreaker('test', threshold=1, reset_timeout=0)
+        breaker.record_failure(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        return breaker
+
+    def test_released_probe_frees_the_slot(self):
+        breaker = self.half_open_breaker()
+        probe = breaker.allow()
+        self.assertEqual(probe, CircuitBreaker.HALF_OPEN)
+        self.assertIsNone(breaker.allow())
+
+        breaker.release(probe)
+        self.assertEqual(breaker.allow(), CircuitBreaker.HALF_OPEN)
+
+    def test_closed_request_does_not_release_the_probe(self):
+        breaker = CircuitBreaker('test', threshold=1, reset_timeout=0)
+        old = breaker.allow()
+        breaker.record_failure(breaker.allow())
+        probe = breaker.allow()
+
+        breaker.release(old)
+        self.assertIsNone(breaker.allow())
+        breaker.record_success(old)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+        breaker.record_success(probe)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# tests/test_workers.py
+
+import asyncio
+import unittest
+
+from bot.helpers.workers import Job, WorkerPool
+
+
+class WorkerPoolTest(unittest.IsolatedAsyncioTestCase):
+    """"""
+
+    async def test_failed_job_state_is_kept(self):
+        pool = WorkerPool('Test', 1)
+
+        async def fail(job: Job):
+            job.stage = 'setup'
+            raise ValueError('boom')
+
+        job = pool.submit('failing', fail)
+        await asyncio.gather(job.task, return_exceptions=True)
+
+        found = pool.get(job.id)
+        self.assertIs(found, job)
+        self.assertEqual(found.state, 'failed')
+        self.assertEqual(found.stage, 'setup')
+        self.assertIsInstance(found.error, ValueError)
+        self.assertIsNotNone(found.finished_at)
+        self.assertNotIn(job.id, pool.jobs)
+        self.assertEqual(pool.finished, [job])
+
+    async def test_history_is_bounded(self):
+        pool = WorkerPool('Test', 2, history_size=2)
+
+        async def done(job: Job):
+            pass
+
+        jobs = [pool.submit(f'job {i}', done) for i in range(3)]
+        await asyncio.gather(*[job.task for job in jobs])
+
+        self.assertEqual([job.state for job in jobs], ['done'] * 3)
+        self.assertEqual(pool.finished, jobs[1:])
+        self.assertIsNone(pool.get(jobs[0].id))
+
+    async def test_history_expires(self):
+        pool = WorkerPool('Test', 1, history_ttl=0)
+
+        async def done(job: Job):
+            pass
+
+        job = pool.submit('expired', done)
+        await job.task
+
+        self.assertIsNone(pool.get(job.id))
+
+
+if __name__ == '__main__':
+    unittest.main()